@@ -0,0 +1,106 @@
+"""Implements the allocation class.
+"""
+
+import numpy as np
+
+import constants as const
+from arrays import top_k_pairs
+
+def _pairs(pairs):
+    """
+        Pack (row, column) pairs into an (n, 2) int array.
+    """
+    return np.array(list(pairs), dtype=np.int32).reshape(-1, 2)
+
+class Allocation(object):
+    """
+        A compact snapshot of which students hold which course spots.
+        Used to roll students and courses back without deep-copying them,
+        and to keep the outcome of each mechanism run on a shared population.
+    """
+
+    def __init__(self, offered, enrolled, n_preferences, course_enrolled, n_enrolled):
+        """
+            params
+            ------
+            offered : np.array[int] (n, 2)
+                (student, course) positions of offered spots.
+            enrolled : np.array[int] (n, 2)
+                (student, course) positions of enrolled spots.
+            n_preferences : np.array[int] (n_students,)
+                # of preferences each student has left for TTC (-1 if unsorted).
+            course_enrolled : np.array[int] (n, 2)
+                (course, student) positions of each course's enrolled students.
+            n_enrolled : np.array[int] (n_courses,)
+                # of spots each course has given out.
+        """
+        self.offered = offered
+        self.enrolled = enrolled
+        self.n_preferences = n_preferences
+        self.course_enrolled = course_enrolled
+        self.n_enrolled = n_enrolled
+
+    @classmethod
+    def capture(cls, courses, students):
+        """
+            Snapshot the current state of the given courses and students.
+        """
+        course_pos = dict((c, j) for j, c in enumerate(courses))
+        student_pos = dict((s, i) for i, s in enumerate(students))
+
+        offered = _pairs(
+            (i, course_pos[c]) for i, s in enumerate(students) for c in s.offered_courses
+        )
+        enrolled = _pairs(
+            (i, course_pos[c]) for i, s in enumerate(students) for c in s.enrolled_courses
+        )
+        n_preferences = np.array(
+            [s._n_preferences if s._order is not None else -1 for s in students],
+            dtype=np.int32
+        )
+        course_enrolled = _pairs(
+            (j, student_pos[s]) for j, c in enumerate(courses) for s in c.enrolled
+        )
+        n_enrolled = np.array([c.n_enrolled for c in courses], dtype=np.int32)
+
+        return cls(offered, enrolled, n_preferences, course_enrolled, n_enrolled)
+
+    def restore(self, courses, students):
+        """
+            Put the given courses and students back in the captured state.
+        """
+        for student, n in zip(students, self.n_preferences.tolist()):
+            student.offered_courses.clear()
+            student.enrolled_courses.clear()
+            if n >= 0:
+                student._n_preferences = n
+            elif student._order is not None:
+                student._n_preferences = len(student._order)
+
+        for i, j in self.offered.tolist():
+            students[i].offered_courses.add(courses[j])
+        for i, j in self.enrolled.tolist():
+            students[i].enrolled_courses.add(courses[j])
+        for student in students:
+            student._reset_card()
+
+        for course, n in zip(courses, self.n_enrolled.tolist()):
+            course.enrolled = set()
+            course.n_enrolled = n
+        for j, i in self.course_enrolled.tolist():
+            courses[j].enrolled.add(students[i])
+
+    def studycards(self, population):
+        """
+            Return (students, courses, values) of every student's study card:
+            the MAX_COURSES most valuable courses they were offered or
+            enrolled in. Positions must be population rows and columns,
+            as they are when captured over population.views().
+        """
+        held = np.concatenate([self.offered, self.enrolled])
+        if len(held):
+            held = np.unique(held, axis=0)
+        rows, columns = held[:, 0], held[:, 1]
+        values = population.values_at(rows, columns)
+        card = top_k_pairs(rows, values, const.MAX_COURSES)
+        return rows[card], columns[card], values[card]
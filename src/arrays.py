@@ -0,0 +1,83 @@
+"""Array helpers shared by the vectorized mechanisms.
+"""
+
+import numpy as np
+
+def top_k_mask(scores, k):
+    """
+        Return a mask of the k[j] highest scores in each column j of a 2-D
+        array, ignoring -inf. Partitions on max(k) rows first, so it's linear
+        in scores.size plus a sort of max(k) rows.
+
+        params
+        ------
+        scores : np.array[float] (n, m)
+            Scores to rank within each column; -inf is never selected.
+        k : int or np.array[int] (m,)
+            How many entries to select in each column.
+    """
+    n, m = scores.shape
+    k = np.minimum(np.broadcast_to(k, (m,)), n)
+    mask = np.zeros(scores.shape, dtype=bool)
+    kmax = int(k.max()) if m else 0
+    if kmax <= 0:
+        return mask
+
+    if kmax < n:
+        top = np.argpartition(-scores, kmax - 1, axis=0)[:kmax]
+    else:
+        top = np.repeat(np.arange(n)[:, None], m, axis=1)
+
+    # Sort the partitioned rows so the first k[j] of each column are the best
+    top_scores = np.take_along_axis(scores, top, axis=0)
+    order = np.argsort(-top_scores, axis=0, kind="mergesort")
+    top = np.take_along_axis(top, order, axis=0)
+    top_scores = np.take_along_axis(top_scores, order, axis=0)
+
+    keep = (np.arange(kmax)[:, None] < k[None, :]) & (top_scores > -np.inf)
+    rows = top[keep]
+    columns = np.nonzero(keep)[1]
+    mask[rows, columns] = True
+    return mask
+
+def group_order(groups, scores):
+    """
+        Return the order that sorts pairs by group, highest score first within
+        each group. Uses a single float sort on group + rescaled score (much
+        faster than lexsort), so scores closer than ~1e-10 of their range may
+        be treated as ties.
+    """
+    finite = scores[np.isfinite(scores)]
+    lo, hi = (finite.min(), finite.max()) if len(finite) else (0., 0.)
+    rescaled = (np.clip(scores, lo, hi) - lo) / (hi - lo) if hi > lo else np.zeros(len(scores))
+    return np.argsort(groups + 0.5 * (1 - rescaled))
+
+def top_k_pairs(groups, scores, k):
+    """
+        Return a mask of the k[g] highest-scoring pairs within each group g,
+        for pairs given as flat arrays. Runs in O(p log p) for p pairs
+        (see group_order for how ties are treated).
+
+        params
+        ------
+        groups : np.array[int] (p,)
+            Group (e.g. student or course) of each pair.
+        scores : np.array[float] (p,)
+            Score of each pair; higher is better.
+        k : int or np.array[int] (n_groups,)
+            How many pairs to select in each group.
+    """
+    mask = np.zeros(len(groups), dtype=bool)
+    if not len(groups):
+        return mask
+
+    # Sort pairs by group, best score first, and rank them within their group
+    order = group_order(groups, scores)
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    lengths = np.diff(np.r_[starts, len(groups)])
+    ranks = np.arange(len(groups)) - np.repeat(starts, lengths)
+
+    k = np.broadcast_to(k, (sorted_groups.max() + 1,)) if np.ndim(k) == 0 else np.asarray(k)
+    mask[order] = ranks < k[sorted_groups]
+    return mask
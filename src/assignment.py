@@ -0,0 +1,154 @@
+"""Implements the assignment class.
+"""
+
+import numpy as np
+
+class Assignment(object):
+    """
+        A mechanism's final outcome as a sparse (n_students x n_courses)
+        matrix: one CSR row per student over the courses on their study card,
+        holding the student's value for each. Welfare metrics are computed
+        directly on the arrays, and assignments can be written to and loaded
+        from .npz files.
+    """
+    # Arrays stored in .npz files, in the order __init__ takes them
+    FIELDS = ("indptr", "indices", "values", "years")
+
+    def __init__(self, indptr, indices, values, years, n_courses):
+        """
+            params
+            ------
+            indptr : np.array[int] (n_students + 1,)
+                Student i's study card is indptr[i]:indptr[i + 1].
+            indices : np.array[int] (n_assigned,)
+                Course of each assigned pair, increasing within each student.
+            values : np.array[float] (n_assigned,)
+                Student's value for the course of each assigned pair.
+            years : np.array[int] (n_students,)
+                Year of each student (1, 2, 3, or 4).
+            n_courses : int
+                # of columns of the matrix.
+        """
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values
+        self.years = years
+        self.n_students = len(years)
+        self.n_courses = n_courses
+
+    @classmethod
+    def from_coo(cls, rows, columns, values, years, n_courses):
+        """
+            Build an assignment from (student, course, value) triples.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        order = np.lexsort((columns, rows))
+        counts = np.bincount(rows, minlength=len(years))
+        indptr = np.r_[0, np.cumsum(counts)].astype(np.int64)
+        return cls(indptr, np.asarray(columns, dtype=np.int32)[order],
+                   np.asarray(values, dtype=float)[order], np.asarray(years), n_courses)
+
+    @classmethod
+    def from_allocation(cls, allocation, population):
+        """
+            Build the assignment of an Allocation captured over
+            population.views() from its study cards.
+        """
+        rows, columns, values = allocation.studycards(population)
+        return cls.from_coo(rows, columns, values, population.years, population.n_courses)
+
+    def coo(self):
+        """
+            Return (students, courses, values) of every assigned pair.
+        """
+        students = np.repeat(np.arange(self.n_students), np.diff(self.indptr))
+        return students, self.indices, self.values
+
+    def save(self, path):
+        """
+            Write the assignment's arrays to the .npz file path.
+        """
+        arrays = dict((field, getattr(self, field)) for field in self.FIELDS)
+        np.savez_compressed(path, n_courses=self.n_courses, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+            Load an assignment written by save.
+        """
+        with np.load(path) as f:
+            return cls(*[f[field] for field in cls.FIELDS], n_courses=int(f["n_courses"]))
+
+    @classmethod
+    def stacked_per_student(cls, assignments):
+        """
+            Return the welfare of every student under each of several
+            assignments over the same students, as an (n_assignments x
+            n_students) array computed in one pass.
+        """
+        n_students = assignments[0].n_students
+        if any(a.n_students != n_students for a in assignments):
+            raise ValueError("assignments are over different # of students")
+        lengths = [len(a.values) for a in assignments]
+        which = np.repeat(np.arange(len(assignments)), lengths)
+        rows = np.concatenate([a.coo()[0] for a in assignments])
+        values = np.concatenate([a.values for a in assignments])
+        per_student = np.bincount(which * n_students + rows, weights=values,
+                                  minlength=len(assignments) * n_students)
+        return per_student.reshape(len(assignments), n_students)
+
+    def per_student(self):
+        """
+            Return each student's welfare (the value of their study card).
+        """
+        return self.stacked_per_student([self])[0]
+
+    def total(self):
+        """
+            Return the total welfare over all students.
+        """
+        return self.values.sum()
+
+    def per_year(self, per_student=None):
+        """
+            Return the mean welfare of the students in each year (1-4), or of
+            per_student in place of each student's welfare if given (one row
+            of values per student, or several stacked rows, giving one row of
+            means for each).
+        """
+        if per_student is None:
+            per_student = self.per_student()
+        in_year = np.asarray(self.years)[:, None] == np.arange(1, 5)
+        counts = in_year.sum(axis=0).astype(float)
+        totals = np.asarray(per_student).dot(in_year)
+        means = np.zeros(totals.shape)
+        np.divide(totals, counts, out=means, where=counts > 0)
+        return means
+
+    def n_assigned(self):
+        """
+            Return the # of courses on each student's study card.
+        """
+        return np.diff(self.indptr)
+
+    def deltas(self, other):
+        """
+            Return this assignment's welfare minus other's, for the same
+            students: a dict of
+                total : float
+                per_year : np.array[float] (4,), mean change by year
+                per_student : np.array[float] (n_students,)
+                better, worse : float, fraction of students better or worse off
+        """
+        if self.n_students != other.n_students:
+            raise ValueError("assignments are over %d and %d students"
+                             % (self.n_students, other.n_students))
+        per_student = self.per_student() - other.per_student()
+        n = float(max(1, self.n_students))
+        return {
+            "total": self.total() - other.total(),
+            "per_year": self.per_year(per_student),
+            "per_student": per_student,
+            "better": (per_student > 0).sum() / n,
+            "worse": (per_student < 0).sum() / n,
+        }
@@ -0,0 +1,136 @@
+"""Run many replications of a lottery as one array computation.
+"""
+import argparse
+
+import numpy as np
+
+import constants as const
+from arrays import top_k_mask
+from factory import Factory
+from stats import RunningStats
+
+MECHANISMS = ["random", "signalling"]
+
+# Bytes per (replication, student, course) cell used while generating and
+# allocating: utilities, interest, keys, scores and masks
+BYTES_PER_CELL = 48
+
+parser = argparse.ArgumentParser(description='Run many lottery replications as batched array computations.')
+parser.add_argument("--mechanism", choices=MECHANISMS, default="random",
+                    help="lottery mechanism to replicate")
+parser.add_argument("--n_courses", type=int, default=10,
+                    help="# of courses in the lottery")
+parser.add_argument("--n_students", type=int, default=30,
+                    help="# of students in the lottery")
+parser.add_argument("--min_cap", type=int, default=2,
+                    help="minimum course enrollment cap")
+parser.add_argument("--max_cap", type=int, default=3,
+                    help="maximum course enrollment cap")
+parser.add_argument("--iters", type=int, default=1000,
+                    help="# of replications to run")
+parser.add_argument("--memory_budget", type=float, default=1024,
+                    help="memory to use per chunk of replications (MB)")
+parser.add_argument("--seed", type=int, default=None,
+                    help="random seed")
+
+def _top_k(scores, k, axis):
+    """
+        Mask of the k highest scores along an axis of an array, with k given
+        per slice (broadcastable to the array's shape without that axis).
+    """
+    moved = np.moveaxis(scores, axis, 0)
+    shape = moved.shape
+    k = np.broadcast_to(k, shape[1:]).ravel()
+    mask = top_k_mask(moved.reshape(shape[0], -1), k)
+    return np.moveaxis(mask.reshape(shape), 0, axis)
+
+def random_priority(utilities, interest, years, caps, rng=np.random, max_courses=None):
+    """
+        Allocate every replication with the year-weighted random lottery.
+        Courses draw in order; students with room accept every offer.
+        Weighted sampling without replacement is done with exponential
+        priority keys (Efraimidis-Spirakis): the cap largest log(u) / year win.
+
+        params
+        ------
+        utilities, interest : np.array (n_replications, n_students, n_courses)
+        years : np.array[int] (n_replications, n_students)
+        caps : np.array[int] (n_replications, n_courses)
+
+        Returns a (n_replications, n_students, n_courses) mask of accepted spots.
+    """
+    max_courses = const.MAX_COURSES if max_courses is None else max_courses
+    n_replications, n_students, n_courses = utilities.shape
+    accepted = np.zeros(utilities.shape, dtype=bool)
+    n_accepted = np.zeros((n_replications, n_students), dtype=int)
+    weights = years.astype(float)
+
+    for j in xrange(n_courses):
+        candidates = interest[:, :, j] & (n_accepted < max_courses)
+        keys = np.log(rng.random_sample((n_replications, n_students))) / weights
+        keys[~candidates] = -np.inf
+        chosen = _top_k(keys, caps[:, j], axis=1)
+        accepted[:, :, j] = chosen
+        n_accepted += chosen
+    return accepted
+
+def signalling(utilities, interest, years, caps, rng=np.random, max_courses=None, n_signals=2):
+    """
+        Allocate every replication with the signalling lottery: students signal
+        their top n_signals courses, courses rank applicants by (signal, year,
+        random tie-break), and students keep their max_courses best offers.
+
+        Returns a (n_replications, n_students, n_courses) mask of accepted spots.
+    """
+    max_courses = const.MAX_COURSES if max_courses is None else max_courses
+
+    scores = np.where(interest, utilities, -np.inf)
+    signals = _top_k(scores, n_signals, axis=2)
+
+    keys = signals * 8. + years[:, :, None] + rng.random_sample(utilities.shape)
+    keys[~interest] = -np.inf
+    offers = _top_k(keys, caps, axis=1)
+
+    scores[~offers] = -np.inf
+    return _top_k(scores, max_courses, axis=2)
+
+def welfare(utilities, accepted):
+    """
+        Total utility of each replication's accepted spots.
+    """
+    return (utilities * accepted).sum(axis=(1, 2))
+
+def run_batched(factory, mechanism, n_replications, rng=np.random, memory_budget=2**30):
+    """
+        Draw n_replications populations and allocate them in chunks that fit
+        in memory_budget bytes. Returns each replication's welfare.
+    """
+    allocate = {"random": random_priority, "signalling": signalling}[mechanism]
+    cells = factory.n_students * factory.n_courses
+    chunk = max(1, int(memory_budget // (cells * BYTES_PER_CELL)))
+
+    welfares = []
+    for start in xrange(0, n_replications, chunk):
+        size = min(chunk, n_replications - start)
+        years, caps, _, _, _, utilities, interest = factory.generate_arrays(rng, size)
+        accepted = allocate(utilities, interest, years, caps, rng)
+        welfares.append(welfare(utilities, accepted))
+    return np.concatenate(welfares) if welfares else np.zeros(0)
+
+def main():
+    args = parser.parse_args()
+    f = Factory(args.n_courses, args.n_students, args.min_cap, args.max_cap)
+    rng = np.random.RandomState(args.seed)
+    welfares = run_batched(f, args.mechanism, args.iters, rng, args.memory_budget * 2**20)
+
+    stats = RunningStats()
+    stats.update_many(welfares)
+    print
+    print "=========================================="
+    print "Welfare (%s, %d replications):" % (args.mechanism, stats.n)
+    print "mean: ", stats.mean, "std: ", stats.std()
+    print "=========================================="
+    print
+
+if __name__ == '__main__':
+    main()
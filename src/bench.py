@@ -0,0 +1,285 @@
+"""Benchmark lottery mechanisms and the TTC cycle finder.
+"""
+import argparse
+import itertools
+import json
+import resource
+import sys
+import time
+import traceback
+from multiprocessing import Pool
+
+import numpy as np
+
+from factory import Factory
+from graph import to_csr, strongly_connected_components
+from lottery import EfficientLottery, RandomLottery, TTCLottery, SignallingLottery
+from ttc import TTC
+
+MECHANISMS = ["efficient", "random", "ttc_lottery", "signalling", "ttc"]
+
+parser = argparse.ArgumentParser(description='Benchmark lottery mechanisms and TTC.')
+subparsers = parser.add_subparsers(dest="command")
+
+cycles_parser = subparsers.add_parser("cycles", help="time the TTC cycle finder on synthetic graphs")
+cycles_parser.add_argument("--n_students", type=int, nargs="+", default=[1000, 10000, 100000],
+                           help="# of students (graph nodes) to benchmark")
+cycles_parser.add_argument("--degree", type=int, default=3,
+                           help="# of holders each student points at")
+cycles_parser.add_argument("--rounds", type=int, default=3,
+                           help="# of rounds to time per size")
+cycles_parser.add_argument("--seed", type=int, default=0,
+                           help="random seed for graph generation")
+
+suite_parser = subparsers.add_parser("suite", help="time every mechanism over a grid of population sizes")
+suite_parser.add_argument("--mechanisms", nargs="+", choices=MECHANISMS, default=MECHANISMS,
+                          help="mechanisms to benchmark")
+suite_parser.add_argument("--n_students", type=int, nargs="+", default=[100, 1000],
+                          help="# of students in the lottery")
+suite_parser.add_argument("--n_courses", type=int, nargs="+", default=[10, 50],
+                          help="# of courses in the lottery")
+suite_parser.add_argument("--caps", nargs="+", default=["2:3", "10:30"],
+                          help="min:max course enrollment caps")
+suite_parser.add_argument("--noise", type=float, nargs="+", default=[4.],
+                          help="stdev of students' values around course quality")
+suite_parser.add_argument("--seeds", type=int, nargs="+", default=[0],
+                          help="population seeds")
+suite_parser.add_argument("--cycle_selection", choices=["longest", "first"], default="first",
+                          help="how TTC picks the cycle to trade in each SCC")
+suite_parser.add_argument("--budget", type=int, default=10000,
+                          help="max # of edges TTC traverses per SCC when enumerating cycles")
+suite_parser.add_argument("--output", default=None,
+                          help="file to write results to (JSON)")
+suite_parser.add_argument("--baseline", default=None,
+                          help="results file (JSON) to compare against")
+suite_parser.add_argument("--tolerance", type=float, default=0.2,
+                          help="relative slowdown vs. baseline that counts as a regression")
+
+memory_parser = subparsers.add_parser("memory", help="measure per-student and per-course object memory")
+memory_parser.add_argument("--n_students", type=int, default=30000,
+                           help="# of students in the population")
+memory_parser.add_argument("--n_courses", type=int, default=50,
+                           help="# of courses in the population")
+memory_parser.add_argument("--caps", default="100:300",
+                           help="min:max course enrollment caps")
+memory_parser.add_argument("--seed", type=int, default=0,
+                           help="population seed")
+
+def random_graph(n_students, degree):
+    """
+        A random top-preference graph where every student points at `degree` others.
+    """
+    children = np.random.randint(n_students, size=(n_students, degree))
+    return dict((i, row) for i, row in enumerate(children.tolist()))
+
+def chain_graph(n_students):
+    """
+        A single pointer chain closed into one long cycle (worst case for recursion).
+    """
+    return dict((i, [(i + 1) % n_students]) for i in xrange(n_students))
+
+def time_round(graph):
+    """
+        Return (seconds to build CSR, seconds to find SCCs, # of SCCs) for one round.
+    """
+    start = time.time()
+    nodes, indptr, indices = to_csr(graph)
+    built = time.time()
+    sccs = strongly_connected_components(indptr, indices)
+    done = time.time()
+    return built - start, done - built, len(sccs)
+
+def bench_cycles(args):
+    """
+        Print per-round cycle finder timings on random and chain graphs.
+    """
+    np.random.seed(args.seed)
+
+    print "%-8s %10s %12s %12s %10s" % ("graph", "students", "csr (s)", "scc (s)", "sccs")
+    for n_students in args.n_students:
+        for name, make_graph in (
+            ("random", lambda: random_graph(n_students, args.degree)),
+            ("chain", lambda: chain_graph(n_students)),
+        ):
+            timings = [time_round(make_graph()) for _ in xrange(args.rounds)]
+            csr_time = np.mean([t[0] for t in timings])
+            scc_time = np.mean([t[1] for t in timings])
+            print "%-8s %10d %12.4f %12.4f %10d" % (name, n_students, csr_time, scc_time, timings[-1][2])
+
+def object_bytes(obj, containers):
+    """
+        Shallow size of an object, its __dict__ (if any) and the named container attributes.
+    """
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+    return size + sum(sys.getsizeof(getattr(obj, name)) for name in containers)
+
+def bench_memory(args):
+    """
+        Print the memory held by Student and Course objects after a RandomLottery,
+        separately from the population's shared arrays.
+    """
+    min_cap, max_cap = [int(c) for c in args.caps.split(":")]
+    rng = np.random.RandomState(args.seed)
+    f = Factory(args.n_courses, args.n_students, min_cap, max_cap)
+    courses, students = f.generate(rng=rng)
+    RandomLottery(courses, students, rng).run()
+
+    population = students[0].population
+    arrays = population.nbytes()
+    student_bytes = sum(object_bytes(s, ("offered_courses", "enrolled_courses", "_card")) for s in students)
+    course_bytes = sum(object_bytes(c, ("enrolled",)) for c in courses)
+
+    print "students: %d, courses: %d" % (len(students), len(courses))
+    print "bytes per student (objects): %.0f" % (student_bytes / float(len(students)))
+    print "bytes per course (objects): %.0f" % (course_bytes / float(len(courses)))
+    print "bytes per student (population arrays): %.0f" % (arrays / float(len(students)))
+
+def peak_rss_mb():
+    """
+        Peak resident memory of this process so far, in MB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def run_case(case):
+    """
+        Time one mechanism on one population. Run in a fresh process so
+        peak memory isn't inherited from earlier cases.
+    """
+    result = dict(case)
+    try:
+        rng = np.random.RandomState(case["seed"])
+        f = Factory(case["n_courses"], case["n_students"], case["min_cap"], case["max_cap"],
+                    case["noise"])
+        courses, students = f.generate(rng=rng)
+        ttc_options = {"cycle_selection": case["cycle_selection"], "budget": case["budget"]}
+
+        # TTC is timed on its own, on the output of RandomLottery
+        if case["mechanism"] == "ttc":
+            RandomLottery(courses, students, rng).run()
+
+        start_rss = peak_rss_mb()
+        start = time.time()
+
+        rounds = None
+        if case["mechanism"] == "efficient":
+            EfficientLottery(courses, students, rng).run()
+        elif case["mechanism"] == "random":
+            lottery = RandomLottery(courses, students, rng)
+            lottery.run()
+            rounds = lottery.rounds
+        elif case["mechanism"] == "ttc_lottery":
+            lottery = TTCLottery(courses, students, rng, **ttc_options)
+            lottery.run()
+            rounds = lottery.ttc.stats["rounds"]
+        elif case["mechanism"] == "signalling":
+            SignallingLottery(courses, students, rng).run()
+        elif case["mechanism"] == "ttc":
+            ttc = TTC(students, rng=rng, **ttc_options)
+            ttc.run()
+            rounds = ttc.stats["rounds"]
+
+        result["wall_time"] = time.time() - start
+        result["peak_rss_mb"] = peak_rss_mb()
+        result["peak_delta_mb"] = result["peak_rss_mb"] - start_rss
+        result["rounds"] = rounds
+        result["welfare"] = sum(s.get_studycard_value() for s in students)
+        result["error"] = None
+    except Exception:
+        result["error"] = traceback.format_exc().strip().splitlines()[-1]
+    return result
+
+def case_key(case):
+    """
+        Identify a case by its mechanism and parameters.
+    """
+    return tuple(case[k] for k in ("mechanism", "n_students", "n_courses",
+                                   "min_cap", "max_cap", "noise", "seed"))
+
+def compare(results, baseline, tolerance):
+    """
+        Return results that got slower than baseline by more than tolerance.
+    """
+    baseline = dict((case_key(b), b) for b in baseline if b.get("error") is None)
+    regressions = []
+    for result in results:
+        base = baseline.get(case_key(result))
+        if base is None or result["error"] is not None:
+            continue
+        if result["wall_time"] > base["wall_time"] * (1 + tolerance):
+            regressions.append((result, base))
+    return regressions
+
+def bench_suite(args):
+    """
+        Benchmark every requested mechanism over the parameter grid.
+        Returns the # of regressions against the baseline.
+    """
+    caps = [tuple(int(c) for c in cap.split(":")) for cap in args.caps]
+    cases = [
+        {
+            "mechanism": mechanism,
+            "n_students": n_students,
+            "n_courses": n_courses,
+            "min_cap": min_cap,
+            "max_cap": max_cap,
+            "noise": noise,
+            "seed": seed,
+            "cycle_selection": args.cycle_selection,
+            "budget": args.budget,
+        }
+        for n_students, n_courses, (min_cap, max_cap), noise, seed, mechanism in itertools.product(
+            args.n_students, args.n_courses, caps, args.noise, args.seeds, args.mechanisms
+        )
+    ]
+
+    print "%-12s %9s %8s %8s %6s %10s %10s %10s %8s" % (
+        "mechanism", "students", "courses", "caps", "noise", "time (s)", "peak (MB)", "+peak (MB)",
+        "rounds")
+    results = []
+    for case in cases:
+        pool = Pool(1, maxtasksperchild=1)
+        result = pool.apply(run_case, (case,))
+        pool.close()
+        pool.join()
+        results.append(result)
+
+        if result["error"] is not None:
+            print "%-12s %9d %8d %8s %6g  failed: %s" % (
+                case["mechanism"], case["n_students"], case["n_courses"],
+                "%d:%d" % (case["min_cap"], case["max_cap"]), case["noise"], result["error"])
+        else:
+            print "%-12s %9d %8d %8s %6g %10.4f %10.1f %10.1f %8s" % (
+                case["mechanism"], case["n_students"], case["n_courses"],
+                "%d:%d" % (case["min_cap"], case["max_cap"]), case["noise"],
+                result["wall_time"], result["peak_rss_mb"], result["peak_delta_mb"],
+                result["rounds"])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        print
+        print "%d regression(s) vs. %s" % (len(regressions), args.baseline)
+        for result, base in regressions:
+            print "  %-12s %s: %.4fs -> %.4fs" % (
+                result["mechanism"], case_key(result)[1:], base["wall_time"], result["wall_time"])
+
+    return len(regressions)
+
+def main():
+    args = parser.parse_args()
+    if args.command == "cycles":
+        bench_cycles(args)
+    elif args.command == "memory":
+        bench_memory(args)
+    elif bench_suite(args):
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""Implements the PopulationCache class.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import constants as const
+from population import Population
+
+# Bump when the way populations are drawn or stored changes
+FORMAT_VERSION = 2
+
+def _save_state(path, state):
+    """
+        Write a RandomState's state next to a stored population.
+    """
+    name, keys, pos, has_gauss, cached_gaussian = state
+    np.save(os.path.join(path, "rng_keys.npy"), keys)
+    with open(os.path.join(path, "rng.json"), "w") as f:
+        json.dump({"name": name, "pos": pos, "has_gauss": has_gauss,
+                   "cached_gaussian": cached_gaussian}, f)
+
+def _load_state(path):
+    """
+        Read a RandomState's state written by _save_state.
+    """
+    with open(os.path.join(path, "rng.json")) as f:
+        state = json.load(f)
+    keys = np.load(os.path.join(path, "rng_keys.npy"))
+    return (str(state["name"]), keys, state["pos"], state["has_gauss"], state["cached_gaussian"])
+
+class PopulationCache(object):
+    """
+        An on-disk cache of generated populations, keyed by a hash of the
+        generation parameters, seed and constants. Each entry is a directory
+        of .npy files that gets memory-mapped on load; least recently used
+        entries are evicted once the cache grows past max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=2**30):
+        """
+            params
+            ------
+            directory : str
+                Directory to keep cached populations in.
+            max_bytes : int
+                Total size the cache is trimmed back to after every store.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def key(factory, seed):
+        """
+            Return the content address of the population factory draws
+            from np.random.RandomState(seed).
+        """
+        params = {
+            "format": FORMAT_VERSION,
+            "n_courses": factory.n_courses,
+            "n_students": factory.n_students,
+            "min_cap": factory.min_cap,
+            "max_cap": factory.max_cap,
+            "noise": float(factory.noise),
+            "seed": seed,
+            "n_subjects": len(const.SUBJECTS),
+            "min_subjects": const.MIN_SUBJECTS,
+            "max_subjects": const.MAX_SUBJECTS,
+        }
+        return hashlib.sha1(json.dumps(params, sort_keys=True)).hexdigest()
+
+    def population(self, factory, seed):
+        """
+            Return (population, rng): the population factory draws from
+            np.random.RandomState(seed), and that random state as it is left
+            after drawing, so callers can keep drawing from it exactly as if
+            the population had been generated. Generates and stores the
+            population on a miss.
+        """
+        path = os.path.join(self.directory, self.key(factory, seed))
+        rng = np.random.RandomState(seed)
+        if os.path.isdir(path):
+            try:
+                population = Population.load(path)
+                rng.set_state(_load_state(path))
+            except (IOError, OSError):
+                # Evicted by another process while we loaded it
+                pass
+            else:
+                self.hits += 1
+                # Mark as recently used
+                os.utime(path, None)
+                return population, rng
+
+        self.misses += 1
+        population = factory.generate_population(rng)
+        self._store(population, rng, path)
+        return population, rng
+
+    def generate(self, factory, seed):
+        """
+            Return (courses, students, rng) for the cached population;
+            see population.
+        """
+        population, rng = self.population(factory, seed)
+        courses, students = population.views()
+        return courses, students, rng
+
+    def _store(self, population, rng, path):
+        """
+            Write population and rng's state to path atomically, then evict
+            old entries.
+        """
+        # Write to a temporary directory and rename it into place, so
+        # concurrent readers never see a partially written entry
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        try:
+            population.save(tmp)
+            _save_state(tmp, rng.get_state())
+            os.rename(tmp, path)
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(path):
+                raise
+        self.evict(keep=path)
+
+    def entries(self):
+        """
+            Return [(last used, size in bytes, path)] for every cached population.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                # Evicted by another process while we looked
+                continue
+        return entries
+
+    def size(self):
+        """
+            Return the total size of the cache in bytes.
+        """
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        """
+            Remove least recently used populations (other than keep) until
+            the cache fits in max_bytes.
+        """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            # Open memory maps keep working after their files are unlinked
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -0,0 +1,186 @@
+"""Compare lottery mechanisms on shared populations.
+"""
+import argparse
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from allocation import Allocation
+from assignment import Assignment
+from factory import Factory
+from lottery import EfficientLottery, RandomLottery, TTCLottery, SignallingLottery
+from shared import SharedPopulation
+from sim import iteration_seeds
+from stats import RunningStats
+
+MECHANISMS = ["efficient", "random", "ttc_lottery", "signalling"]
+
+LOTTERIES = {
+    "efficient": EfficientLottery,
+    "random": RandomLottery,
+    "ttc_lottery": TTCLottery,
+    "signalling": SignallingLottery,
+}
+
+parser = argparse.ArgumentParser(description="Compare lottery mechanisms on the same populations.")
+parser.add_argument("--mechanisms", nargs="+", choices=MECHANISMS, default=MECHANISMS,
+                    help="mechanisms to compare")
+parser.add_argument("--n_courses", type=int, default=10,
+                    help="# of courses in the lottery")
+parser.add_argument("--n_students", type=int, default=30,
+                    help="# of students in the lottery")
+parser.add_argument("--min_cap", type=int, default=2,
+                    help="minimum course enrollment cap")
+parser.add_argument("--max_cap", type=int, default=3,
+                    help="maximum course enrollment cap")
+parser.add_argument("--iters", type=int, default=1,
+                    help="# of populations to compare mechanisms on")
+parser.add_argument("--seed", type=int, default=None,
+                    help="master seed that every population is derived from")
+parser.add_argument("--cycle_selection", choices=["longest", "first"], default="longest",
+                    help="how TTC picks the cycle to trade in each SCC")
+parser.add_argument("--budget", type=int, default=None,
+                    help="max # of edges TTC traverses per SCC when enumerating cycles")
+parser.add_argument("--priority_keys", action="store_true",
+                    help="draw random lotteries with year-weighted priority keys in one pass")
+parser.add_argument("--workers", type=int, default=1,
+                    help="# of processes to run mechanisms in (sharing each population)")
+parser.add_argument("--save_allocations", type=str, default=None, metavar="DIR",
+                    help="write each mechanism's final allocation to DIR/<iteration>-<mechanism>.npz")
+
+def run_mechanism(population, mechanism, state, ttc_options=None, priority_keys=False):
+    """
+        Run a mechanism on its own Student and Course views over population,
+        starting from the random state state, and return its Allocation.
+    """
+    rng = np.random.RandomState()
+    rng.set_state(state)
+    courses, students = population.views()
+    options = {}
+    if mechanism in ("random", "ttc_lottery"):
+        options["priority_keys"] = priority_keys
+    if mechanism == "ttc_lottery":
+        options.update(ttc_options or {})
+    LOTTERIES[mechanism](courses, students, rng, **options).run()
+    return Allocation.capture(courses, students)
+
+def _run_shared(args):
+    """
+        Run a mechanism in a pool worker on a SharedPopulation.
+    """
+    shared, mechanism, state, ttc_options, priority_keys = args
+    return run_mechanism(shared.attach(), mechanism, state, ttc_options, priority_keys)
+
+def run_mechanisms(population, mechanisms, rng, ttc_options=None, priority_keys=False, pool=None):
+    """
+        Run each mechanism on its own views over a frozen population and
+        return {mechanism: Allocation}. Every mechanism starts from rng's
+        current state, so the random lottery and the random lottery + TTC
+        see the same draws. With a pool, mechanisms run in its workers,
+        which memory-map one shared copy of the population.
+    """
+    population.freeze()
+    state = rng.get_state()
+
+    if pool is None:
+        allocations = [run_mechanism(population, m, state, ttc_options, priority_keys)
+                       for m in mechanisms]
+    else:
+        with SharedPopulation(population) as shared:
+            allocations = pool.map(_run_shared, [(shared, m, state, ttc_options, priority_keys)
+                                                 for m in mechanisms], chunksize=1)
+    return dict(zip(mechanisms, allocations))
+
+def welfare(assignments):
+    """
+        Return per-mechanism welfare computed in one pass over every
+        mechanism's Assignment over the same students: a dict of
+            total : np.array[float] (n_mechanisms,)
+            per_student : np.array[float] (n_mechanisms, n_students)
+            per_year : np.array[float] (n_mechanisms, 4), mean welfare by year
+            n_courses : np.array[float] (n_mechanisms,), mean study card size
+    """
+    per_student = Assignment.stacked_per_student(assignments)
+    n_assigned = np.array([len(a.values) for a in assignments])
+    return {
+        "total": per_student.sum(axis=1),
+        "per_student": per_student,
+        "per_year": assignments[0].per_year(per_student),
+        "n_courses": n_assigned / float(max(1, assignments[0].n_students)),
+    }
+
+def compare(n_courses, n_students, min_cap, max_cap, iters, mechanisms=MECHANISMS,
+            seed=None, cycle_selection="longest", budget=None, priority_keys=False, workers=1,
+            save_allocations=None):
+    """
+        Compare mechanisms' welfare over iters populations, each generated
+        once and shared by every mechanism (across workers processes).
+        Each mechanism's final allocation is written to save_allocations if given.
+    """
+    f = Factory(n_courses, n_students, min_cap, max_cap)
+    ttc_options = {"cycle_selection": cycle_selection, "budget": budget}
+    seeds = iteration_seeds(seed, iters)
+
+    totals = dict((m, RunningStats()) for m in mechanisms)
+    means = dict((m, RunningStats()) for m in mechanisms)
+    years = dict((m, [RunningStats() for _ in xrange(4)]) for m in mechanisms)
+    sizes = dict((m, RunningStats()) for m in mechanisms)
+    pool = Pool(workers) if workers > 1 else None
+    if save_allocations is not None and not os.path.isdir(save_allocations):
+        os.makedirs(save_allocations)
+    for i, iteration_seed in enumerate(seeds):
+        rng = np.random.RandomState(iteration_seed)
+        population = f.generate_population(rng)
+        allocations = run_mechanisms(population, mechanisms, rng, ttc_options, priority_keys, pool)
+        assignments = [Assignment.from_allocation(allocations[m], population) for m in mechanisms]
+        result = welfare(assignments)
+
+        if save_allocations is not None:
+            for m, assignment in zip(mechanisms, assignments):
+                assignment.save(os.path.join(save_allocations, "%d-%s.npz" % (i, m)))
+
+        for k, m in enumerate(mechanisms):
+            totals[m].update(result["total"][k])
+            means[m].update(result["per_student"][k].mean() if n_students else 0.)
+            sizes[m].update(result["n_courses"][k])
+            for year in xrange(4):
+                years[m][year].update(result["per_year"][k, year])
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    print
+    print "=========================================="
+    print "%-12s %12s %10s %12s %8s   %s" % ("mechanism", "welfare", "std", "per student",
+                                             "courses", "per year (1-4)")
+    for m in mechanisms:
+        print "%-12s %12.4f %10.4f %12.4f %8.3f   %s" % (
+            m, totals[m].mean, totals[m].std(), means[m].mean, sizes[m].mean,
+            " ".join("%.3f" % y.mean for y in years[m])
+        )
+    print "=========================================="
+    print
+
+    return totals
+
+def main():
+    args = parser.parse_args()
+    compare(
+        args.n_courses,
+        args.n_students,
+        args.min_cap,
+        args.max_cap,
+        args.iters,
+        args.mechanisms,
+        args.seed,
+        args.cycle_selection,
+        args.budget,
+        args.priority_keys,
+        args.workers,
+        args.save_allocations
+    )
+
+if __name__ == '__main__':
+    main()
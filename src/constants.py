@@ -4,7 +4,7 @@
 N_SUBJECTS = 3
 
 # Possible course subjects
-SUBJECTS = [
+ALL_SUBJECTS = [
     "Math",
     "Economics",
     "Computer Science",
@@ -25,7 +25,8 @@ SUBJECTS = [
     "History",
     "East Asian Studies",
     "Psychology"
-][:N_SUBJECTS]
+]
+SUBJECTS = ALL_SUBJECTS[:N_SUBJECTS]
 
 # Number of students
 N_STUDENTS = 1000
@@ -41,4 +42,28 @@ MAX_SUBJECTS = min(3, N_SUBJECTS)
 MAX_COURSES = 4
 
 # How much noise to include in student preferences (stdev of a normal distribution)
-NOISE = 4
\ No newline at end of file
+NOISE = 4
+
+# Constants that can be overridden with configure; the rest are derived from them
+CONFIGURABLE = ["N_SUBJECTS", "N_STUDENTS", "N_COURSES", "MAX_COURSES", "NOISE"]
+
+def configure(**values):
+    """
+        Override constants in-process (e.g. configure(N_SUBJECTS=5, NOISE=2))
+        and recompute the ones derived from them. Code reads constants as
+        const.X when it runs, so this takes effect for everything created
+        afterwards. Returns the previous values, to restore them with.
+    """
+    global SUBJECTS, MIN_SUBJECTS, MAX_SUBJECTS
+
+    unknown = set(values) - set(CONFIGURABLE)
+    if unknown:
+        raise TypeError("can't configure constants: %s" % ", ".join(sorted(unknown)))
+
+    previous = dict((name, globals()[name]) for name in values)
+    globals().update(values)
+
+    SUBJECTS = ALL_SUBJECTS[:N_SUBJECTS]
+    MIN_SUBJECTS = min(1, N_SUBJECTS)
+    MAX_SUBJECTS = min(3, N_SUBJECTS)
+    return previous
@@ -1,30 +1,46 @@
 """Implements the course class.
 """
 
-from random import random, choice
-
-import constants as const
+def _course(cls, number):
+    """
+        Create a course with only its number set, for copy and pickle.
+    """
+    course = cls.__new__(cls)
+    course.number = number
+    return course
 
 class Course(object):
     """
         A course with a capacity and desirability.
     """
+    __slots__ = ("population", "number", "n_enrolled", "enrolled")
 
-    def __init__(self, number, cap):
+    def __init__(self, population, number):
         """
-            Create a new course with given capacity and desirability.
+            params
+            ------
+            population : Population
+                The population this course belongs to.
+            number : int
+                The course's column in the population's arrays.
         """
+        self.population = population
         self.number = number
-        self.cap = cap
 
-        # Initialize course subject
-        self.subject = choice(const.SUBJECTS)
+        self.n_enrolled = 0
+        self.enrolled = set()
 
-        # Initialize course quality (0 to 5)
-        self.quality = random() * 5
+    @property
+    def cap(self):
+        return int(self.population.caps[self.number])
 
-        self.n_enrolled = 0
-        self.enrolled = []
+    @property
+    def subject(self):
+        return self.population.subjects[self.population.course_subjects[self.number]]
+
+    @property
+    def quality(self):
+        return float(self.population.quality[self.number])
 
     def enroll(self, student):
         """
@@ -35,7 +51,7 @@ class Course(object):
         if self.n_enrolled >= self.cap:
             return False
         self.n_enrolled += 1
-        self.enrolled.append(student)
+        self.enrolled.add(student)
         student.offer_spot(self)
         return True
 
@@ -59,5 +75,19 @@ class Course(object):
         """
         return self.n_enrolled < self.cap
 
+    def __hash__(self):
+        # Hash by column so set iteration order doesn't depend on memory layout
+        return self.number
+
+    def __reduce__(self):
+        # Set number before the rest of the state, which may hold sets that
+        # contain this course (e.g. through its students), so it can be hashed
+        state = dict((name, getattr(self, name)) for name in self.__slots__)
+        return _course, (self.__class__, self.number), state
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
     def __repr__(self):
-        return str(self.number)
\ No newline at end of file
+        return str(self.number)
@@ -1,16 +1,20 @@
 """Factory for generating students and courses.
 """
 
-from random import randint, seed
+from random import seed
 
-from student import Student 
-from course import Course
+import numpy as np
+
+import constants as const
+from population import Population, dense_to_csr
 
 class Factory(object):
     """
         Generate a set of students and courses based on certain parameters.
     """
-    def __init__(self, n_courses, n_students, min_cap, max_cap):
+    # Max # of utilities drawn at once when generating a population
+    BLOCK_CELLS = 2**22
+    def __init__(self, n_courses, n_students, min_cap, max_cap, noise=None):
         """
             params
             ------
@@ -22,23 +26,106 @@ class Factory(object):
                 The lowest allowed enrollment cap.
             max_cap  : int
                 The highest allowed enrollment cap.
+            noise    : float
+                Stdev of students' values around course quality
+                (defaults to const.NOISE).
         """
         self.n_courses = n_courses
         self.n_students = n_students
         self.min_cap = min_cap
         self.max_cap = max_cap
+        self.noise = const.NOISE if noise is None else noise
 
-    def generate(self, seed_int=None):
+    def generate(self, seed_int=None, rng=np.random):
         """
             Generate course catalog and students with requested preferences.
+
+            params
+            ------
+            seed_int : int
+                Seed for the global random state.
+            rng : np.random.RandomState
+                Random state to draw from (defaults to the global one).
         """
         if seed_int:
             seed(seed_int)
+            np.random.seed(seed_int)
+
+        population = self.generate_population(rng)
+        return population.views()
+
+    def generate_population(self, rng=np.random):
+        """
+            Draw a Population with one vectorized call per quantity. Utilities
+            are drawn a block of students at a time and only their interest
+            pairs are kept, so the dense utility matrix is never held in memory.
+            Draws the same population from rng as generate_arrays.
+        """
+        years, caps, quality, course_subjects, student_subjects = self._draw_attributes(rng)
+
+        block = max(1, self.BLOCK_CELLS // max(1, self.n_courses))
+        indptr, indices, values = [np.zeros(1, dtype=np.int64)], [], []
+        for start in xrange(0, max(1, self.n_students), block):
+            utilities, interest = self._draw_utilities(
+                rng, quality, course_subjects, student_subjects[start:start + block]
+            )
+            block_indptr, block_indices, block_values = dense_to_csr(utilities, interest)
+            indptr.append(block_indptr[1:] + indptr[-1][-1])
+            indices.append(block_indices)
+            values.append(block_values)
+
+        indptr, indices, values = [np.concatenate(a) for a in (indptr, indices, values)]
+        return Population(years, caps, quality, course_subjects, student_subjects, indptr, indices, values)
+
+    def generate_arrays(self, rng=np.random, n_replications=None):
+        """
+            Draw the arrays of a Population as dense (n_students x n_courses)
+            utility and interest arrays, in the order Population.from_dense
+            takes them. With n_replications, every array gets a leading
+            replications axis.
+        """
+        lead = () if n_replications is None else (n_replications,)
+        years, caps, quality, course_subjects, student_subjects = self._draw_attributes(rng, lead)
+        utilities, interest = self._draw_utilities(rng, quality, course_subjects, student_subjects)
+        return years, caps, quality, course_subjects, student_subjects, utilities, interest
+
+    def _draw_attributes(self, rng, lead=()):
+        """
+            Draw (years, caps, quality, course_subjects, student_subjects).
+        """
+        n_subjects = len(const.SUBJECTS)
+
+        # Initialize course caps, subjects and qualities (0 to 5)
+        caps = rng.randint(self.min_cap, self.max_cap + 1, size=lead + (self.n_courses,))
+        course_subjects = rng.randint(n_subjects, size=lead + (self.n_courses,))
+        quality = rng.random_sample(lead + (self.n_courses,)) * 5
+
+        # Initialize student years
+        years = rng.randint(1, 5, size=lead + (self.n_students,))
+
+        # Randomly choose subjects to be interested in: rank subjects in a
+        # random order per student and keep the first k of them
+        k = rng.randint(const.MIN_SUBJECTS, const.MAX_SUBJECTS + 1, size=lead + (self.n_students,))
+        ranks = rng.random_sample(lead + (self.n_students, n_subjects)).argsort(axis=-1).argsort(axis=-1)
+        student_subjects = ranks < k[..., None]
+
+        return years, caps, quality, course_subjects, student_subjects
+
+    def _draw_utilities(self, rng, quality, course_subjects, student_subjects):
+        """
+            Draw (utilities, interest) for the students whose subjects are
+            given, with any leading replications axis of the inputs.
+        """
+        # Student's value is normally distributed around course quality
+        shape = student_subjects.shape[:-1] + (self.n_courses,)
+        utilities = rng.normal(scale=self.noise, size=shape)
+        utilities += quality[..., None, :]
 
-        make_new_course = lambda n: Course(n, randint(self.min_cap, self.max_cap))
-        courses = [make_new_course(i) for i in xrange(self.n_courses)]
-        
-        make_new_student = lambda: Student(randint(1, 4), courses)
-        students = [make_new_student() for _ in xrange(self.n_students)]
+        # Only lottery for courses with positive value in an interesting subject
+        interest = np.take_along_axis(
+            student_subjects, np.broadcast_to(course_subjects[..., None, :], shape), axis=-1
+        )
+        interest &= utilities >= 0
+        utilities[~interest] = 0
 
-        return courses, students
\ No newline at end of file
+        return utilities, interest
@@ -0,0 +1,109 @@
+"""Integer-indexed graph utilities for TTC.
+"""
+
+import numpy as np
+
+def to_csr(graph):
+    """
+        Convert a {node: [children]} graph to CSR adjacency arrays.
+
+        Returns (nodes, indptr, indices), where the children of nodes[i]
+        are nodes[indices[indptr[i]:indptr[i + 1]]].
+    """
+    nodes = list(graph.iterkeys())
+    position = dict((node, i) for i, node in enumerate(nodes))
+
+    # Children that aren't keys in the graph are sinks
+    for children in graph.itervalues():
+        for child in children:
+            if child not in position:
+                position[child] = len(nodes)
+                nodes.append(child)
+
+    degrees = np.zeros(len(nodes), dtype=np.int64)
+    degrees[:len(graph)] = [len(graph[node]) for node in nodes[:len(graph)]]
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(degrees, out=indptr[1:])
+
+    indices = np.fromiter(
+        (position[child] for node in nodes[:len(graph)] for child in graph[node]),
+        dtype=np.int64,
+        count=indptr[-1]
+    )
+
+    return nodes, indptr, indices
+
+def strongly_connected_components(indptr, indices):
+    """
+        Find the strongly connected components of a CSR graph with an
+        iterative version of Tarjan's algorithm, in O(nodes + edges).
+        With reference to: https://en.wikipedia.org/wiki/Tarjan%27s_strongly_connected_components_algorithm
+
+        Returns a list of SCCs, each a list of node indices, in reverse
+        topological order.
+    """
+    n = len(indptr) - 1
+    indptr = indptr.tolist()
+    indices = indices.tolist()
+
+    # Bookkeeping
+    index = [-1] * n
+    lowlinks = [0] * n
+    on_stack = [False] * n
+    stack = []
+    counter = 0
+
+    sccs = []
+    for root in xrange(n):
+        if index[root] != -1:
+            continue
+
+        index[root] = lowlinks[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+
+        # Explicit DFS stack of (node, next edge to visit)
+        work = [(root, indptr[root])]
+        while work:
+            node, edge = work[-1]
+            end = indptr[node + 1]
+
+            descended = False
+            while edge < end:
+                child = indices[edge]
+                edge += 1
+                if index[child] == -1:
+                    # Visit the child before finishing the node's other edges
+                    work[-1] = (node, edge)
+                    index[child] = lowlinks[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack[child] = True
+                    work.append((child, indptr[child]))
+                    descended = True
+                    break
+                elif on_stack[child]:
+                    lowlinks[node] = min(lowlinks[node], index[child])
+
+            if descended:
+                continue
+
+            # All children visited
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlinks[parent] = min(lowlinks[parent], lowlinks[node])
+
+            # If we're at an SCC root, build the SCC
+            if lowlinks[node] == index[node]:
+                scc = []
+                while True:
+                    nxt = stack.pop()
+                    on_stack[nxt] = False
+                    scc.append(nxt)
+                    if nxt == node:
+                        break
+                sccs.append(scc)
+
+    return sccs
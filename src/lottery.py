@@ -3,23 +3,38 @@
 
 from random import randint
 
-from numpy.random import choice
+import numpy as np
 
 import constants as const
+from arrays import group_order, top_k_pairs
 from ttc import TTC
 from course import Course
 from student import Student
+from tracing import NULL_TRACER
 
 class Lottery(object):
     """
         Assigns students to courses.
     """
-    def __init__(self, courses, students):
+    def __init__(self, courses, students, rng=np.random, tracer=NULL_TRACER):
         """
             Create a new lottery.
+
+            params
+            ------
+            courses : list[Course]
+                Courses to allocate spots in.
+            students : list[Student]
+                Students to allocate spots to.
+            rng : np.random.RandomState
+                Random state to draw from (defaults to the global one).
+            tracer : tracing.Tracer
+                Receives per-round phase timings and counters.
         """
         self.courses = courses
         self.students = students
+        self.rng = rng
+        self.tracer = tracer
 
         self.n_courses = len(courses)
         self.n_students = len(students)
@@ -30,6 +45,43 @@ class Lottery(object):
         """
         raise AssertionError("Lottery.run not implemented")
 
+    def _apply(self, rows, columns):
+        """
+            Offer students[rows[k]] a spot in courses[columns[k]] for every k,
+            then have every student make acceptances and rejections.
+        """
+        for i, j in zip(rows.tolist(), columns.tolist()):
+            self.courses[j].enroll(self.students[i])
+        for student in self.students:
+            student.get_studycard_destructive()
+
+    def _pairs(self):
+        """
+            Return (student positions, course positions, values) of the
+            interest pairs between this lottery's students and courses,
+            ordered by student position.
+        """
+        population = self.courses[0].population
+        rows = np.array([s.index for s in self.students], dtype=int)
+        columns = np.array([c.number for c in self.courses], dtype=int)
+        if (len(rows) == population.n_students and len(columns) == population.n_courses
+                and (rows == np.arange(len(rows))).all()
+                and (columns == np.arange(len(columns))).all()):
+            return population.pairs()
+
+        # Gather the selected students' rows, then keep the selected courses
+        starts = population.indptr[rows]
+        counts = population.indptr[rows + 1] - starts
+        offsets = np.r_[0, np.cumsum(counts)[:-1]].astype(int)
+        positions = np.repeat(starts - offsets, counts) + np.arange(counts.sum())
+        students = np.repeat(np.arange(len(rows)), counts)
+
+        course_positions = np.full(population.n_courses, -1, dtype=int)
+        course_positions[columns] = np.arange(len(columns))
+        courses = course_positions[population.indices[positions]]
+        keep = courses >= 0
+        return students[keep], courses[keep], population.values[positions[keep]]
+
 
 class EfficientLottery(Lottery):
     """
@@ -37,83 +89,207 @@ class EfficientLottery(Lottery):
         Used as a point of comparison to possible course assignment mechanisms.
     """
 
+    def allocate(self):
+        """
+            Return (student positions, course positions, values) of the spots
+            students end up with, computed over (student, course) interest pairs.
+        """
+        rows, columns, values = self._pairs()
+
+        # Courses offer spots to interested students with highest true values
+        caps = np.array([c.spots() for c in self.courses], dtype=int)
+        offers = top_k_pairs(columns, values, caps)
+
+        # Students accept their MAX_COURSES most valuable offers
+        rows, columns, values = rows[offers], columns[offers], values[offers]
+        room = np.array([const.MAX_COURSES - len(s.enrolled_courses) for s in self.students], dtype=int)
+        accepts = top_k_pairs(rows, values, room)
+        return rows[accepts], columns[accepts], values[accepts]
+
     def run(self):
         """
             Return an optimal allocation of students to courses.
         """
+        if not self.courses or not self.students:
+            return self.students
 
-        # Courses offer spots to students with highest true values
-        for i in xrange(self.n_courses):
-            get_student_pref = lambda s: s.preferences[i]
-            sorted_students = sorted(self.students, key=get_student_pref, reverse=True)
-            for student in sorted_students:
-                self.courses[i].enroll(student)
+        rows, columns, _ = self.allocate()
+        self._apply(rows, columns)
 
         # Return utility to students
         return self.students
 
+    def welfare(self):
+        """
+            Return the total utility of the efficient allocation, without
+            touching students or courses.
+        """
+        if not self.courses or not self.students:
+            return 0.
+        _, _, values = self.allocate()
+        return float(values.sum())
+
 
 class RandomLottery(Lottery):
     """
         A simplified model of current Harvard lottery system.
     """
 
+    def __init__(self, courses, students, rng=np.random, tracer=NULL_TRACER, priority_keys=False):
+        """
+            Create a new lottery; with priority_keys, every draw is made up
+            front by giving each (student, course) pair a year-weighted key.
+        """
+        super(RandomLottery, self).__init__(courses, students, rng, tracer)
+        self.priority_keys = priority_keys
+        self.rounds = 0
+
     def run(self):
         """
             Return a random allocation of students to courses, weighted by year.
         """
+        if not self.courses or not self.students:
+            return self.students
+        if self.priority_keys:
+            return self._run_priority_keys()
+
+        tracer = self.tracer
+        with tracer.phase("index"):
+            interested_students = self._interested_students()
 
-        courses_with_room = set([c for c in self.courses if c.has_room()])
-        students_with_room = [s for s in self.students if s.has_room() and s.interested & courses_with_room]
+        # Students who can still accept offers
+        active = set(s for s in self.students if s.has_room())
 
         # Run the lottery loop repeatedly until we've assigned as many people as we can
-        while courses_with_room and students_with_room:
-            
+        courses = set(self.courses)
+        n_offers = -1
+        self.rounds = 0
+        while n_offers and active:
+            n_offers = 0
+            self.rounds += 1
+
             # Courses offer spots to students through weighted random lottery
-            for course in courses_with_room:
+            for course in courses:
+                if not course.has_room():
+                    continue
 
-                # Collect all students who are interested in the course's subject
-                interested_students = [s for s in students_with_room if course in s.interested]
+                with tracer.phase("draw"):
+                    # Collect students with room who don't already hold the course
+                    candidates = [
+                        s for s in interested_students[course]
+                        if s in active
+                        and course not in s.enrolled_courses
+                        and course not in s.offered_courses
+                    ]
 
-                if not interested_students:
-                    continue
-                
-                # Construct the weights on students
-                years = [s.year for s in interested_students]
-                norm = float(sum(years))
-                weights = [y / norm for y in years]
-                
-                cap = min(len(interested_students), course.spots())
-
-                # Offer spots to randomly chosen students in the course
-                chosen_students = choice(interested_students, cap, replace=False, p=weights)
-                for student in chosen_students:
-                    course.enroll(student)
+                    if not candidates:
+                        continue
 
-                # Students make acceptances and rejections
-                for student in students_with_room:
-                    student.get_studycard_destructive()
+                    # Construct the weights on students
+                    years = np.array([s.year for s in candidates], dtype=float)
+                    weights = years / years.sum()
+
+                    cap = min(len(candidates), course.spots())
 
-                courses_with_room = set([c for c in self.courses if c.has_room()])
-                students_with_room = [s for s in self.students if s.has_room() and s.interested & courses_with_room]
+                    # Offer spots to randomly chosen students in the course
+                    chosen_students = self.rng.choice(candidates, cap, replace=False, p=weights)
+                    for student in chosen_students:
+                        course.enroll(student)
+                    n_offers += cap
+
+                # Only students who got an offer need to make acceptances and rejections
+                with tracer.phase("studycard"):
+                    for student in chosen_students:
+                        student.get_studycard_destructive()
+                        if not student.has_room():
+                            active.discard(student)
+
+            tracer.count("offers", n_offers)
+            tracer.end_round("random_lottery", self.rounds)
 
         # Return students
         return self.students
 
+    def _run_priority_keys(self):
+        """
+            Run the lottery with Efraimidis-Spirakis keys log(u) / year: the
+            cap highest keys among a course's candidates are a year-weighted
+            sample without replacement, so each course just walks its
+            interested students in key order until it is full.
+        """
+        tracer = self.tracer
+        with tracer.phase("index"):
+            rows, columns, _ = self._pairs()
+
+            # Draw every pair's key in one call and sort pairs by course, best key first
+            years = np.array([s.year for s in self.students], dtype=float)
+            keys = np.log(self.rng.random_sample(len(rows))) / years[rows]
+            order = group_order(columns, keys)
+            rows, columns = rows[order], columns[order]
+            bounds = np.searchsorted(columns, np.arange(self.n_courses + 1)).tolist()
+            rows = rows.tolist()
+            positions = dict((course, j) for j, course in enumerate(self.courses))
+
+        # One pass suffices: a course only passes over students who are full,
+        # and those can't take spots in any later round either
+        self.rounds = 1
+        n_offers = 0
+        for course in set(self.courses):
+            j = positions[course]
+            with tracer.phase("draw"):
+                for i in rows[bounds[j]:bounds[j + 1]]:
+                    if not course.has_room():
+                        break
+                    student = self.students[i]
+                    if (not student.has_room()
+                            or course in student.enrolled_courses
+                            or course in student.offered_courses):
+                        continue
+                    course.enroll(student)
+                    student.get_studycard_destructive()
+                    n_offers += 1
+
+        tracer.count("offers", n_offers)
+        tracer.end_round("random_lottery", self.rounds)
+        return self.students
+
+    def _interested_students(self):
+        """
+            Build an inverted index from each course to the students interested in it.
+        """
+        rows, columns, _ = self._pairs()
+        order = np.argsort(columns, kind="mergesort")
+        bounds = np.searchsorted(columns[order], np.arange(self.n_courses + 1)).tolist()
+        rows = rows[order].tolist()
+
+        interested_students = {}
+        for j, course in enumerate(self.courses):
+            interested_students[course] = [self.students[i] for i in rows[bounds[j]:bounds[j + 1]]]
+        return interested_students
+
 
 class TTCLottery(RandomLottery):
     """
         Random lottery + TTC.
     """
 
+    def __init__(self, courses, students, rng=np.random, tracer=NULL_TRACER,
+                 priority_keys=False, **ttc_options):
+        """
+            Create a new lottery; ttc_options are passed on to TTC.
+        """
+        super(TTCLottery, self).__init__(courses, students, rng, tracer, priority_keys)
+        self.ttc_options = ttc_options
+        self.ttc = None
+
     def run(self):
         """
             Run the Harvard lottery, then trade results with TTC.
         """
         self.students = super(TTCLottery, self).run()
 
-        ttc = TTC(self.students)
-        ttc.run()
+        self.ttc = TTC(self.students, rng=self.rng, tracer=self.tracer, **self.ttc_options)
+        self.ttc.run()
 
         return self.students
 
@@ -122,25 +298,37 @@ class SignallingLottery(Lottery):
     """
         A mechanism wherein students can signal interest to their top 2 favorite courses.
     """
+    N_SIGNALS = 2
 
-    def run(self):
+    def allocate(self):
         """
-            Return an interest-informed allocation of students to courses.
+            Return (student positions, course positions) of the spots students
+            end up with, computed over (student, course) interest pairs.
         """
-        # Courses offer spots to oldest interested students first
-        for course in xrange(self.n_courses):
-            # Students who might enter the lottery
-            interested_students = [s for s in self.students if s.preferences[course] > 0]
+        rows, columns, values = self._pairs()
 
-            # Sort students by interest then by year
-            interested_students = sorted(
-                interested_students,
-                key=lambda s: (s.get_token(course), s.year), 
-                reverse=True
-            )
+        # Students signal their most valuable courses
+        signals = top_k_pairs(rows, values, self.N_SIGNALS)
 
-            for student in interested_students[:self.courses[course].cap]:
-                self.courses[course].enroll(student)
+        # Courses offer spots to signalling students first, then oldest students,
+        # breaking remaining ties at random
+        years = np.array([s.year for s in self.students])
+        keys = signals * 8. + years[rows] + self.rng.random_sample(len(rows))
+        caps = np.array([c.spots() for c in self.courses], dtype=int)
+        offers = top_k_pairs(columns, keys, caps)
 
-        return self.students
+        # Students accept their MAX_COURSES most valuable offers
+        rows, columns, values = rows[offers], columns[offers], values[offers]
+        room = np.array([const.MAX_COURSES - len(s.enrolled_courses) for s in self.students], dtype=int)
+        accepts = top_k_pairs(rows, values, room)
+        return rows[accepts], columns[accepts]
 
+    def run(self):
+        """
+            Return an interest-informed allocation of students to courses.
+        """
+        if not self.courses or not self.students:
+            return self.students
+
+        self._apply(*self.allocate())
+        return self.students
@@ -0,0 +1,179 @@
+"""Implements the population class.
+"""
+
+import json
+import os
+
+import numpy as np
+
+import constants as const
+from course import Course
+from student import Student
+
+def dense_to_csr(utilities, interest):
+    """
+        Return (indptr, indices, values) of the interested entries of an
+        (n_students x n_courses) utility array.
+    """
+    indptr = np.r_[0, np.cumsum(interest.sum(axis=1))].astype(np.int64)
+    indices = np.nonzero(interest)[1].astype(np.int32)
+    return indptr, indices, utilities[interest]
+
+class Population(object):
+    """
+        Array-backed storage for a set of students and courses.
+        Student and Course objects are thin views over rows and columns.
+
+        Students' values are stored sparsely, as one CSR row per student over
+        the courses they're interested in, so memory and the cost of scanning
+        preferences scale with interest pairs rather than students x courses.
+    """
+    # Arrays stored on disk, in the order __init__ takes them
+    FIELDS = ("years", "caps", "quality", "course_subjects", "student_subjects",
+              "indptr", "indices", "values")
+
+    def __init__(self, years, caps, quality, course_subjects, student_subjects, indptr, indices, values,
+                 subjects=None):
+        """
+            params
+            ------
+            years : np.array[int] (n_students,)
+                Year of each student (1, 2, 3, or 4).
+            caps : np.array[int] (n_courses,)
+                Enrollment cap of each course.
+            quality : np.array[float] (n_courses,)
+                Quality of each course (0 to 5).
+            course_subjects : np.array[int] (n_courses,)
+                Index into subjects of each course's subject.
+            student_subjects : np.array[bool] (n_students, n_subjects)
+                Mask of the subjects each student is interested in.
+            indptr : np.array[int] (n_students + 1,)
+                Student i's interest pairs are indptr[i]:indptr[i + 1].
+            indices : np.array[int] (n_pairs,)
+                Course of each interest pair, increasing within each student.
+            values : np.array[float] (n_pairs,)
+                Student's value for the course of each interest pair.
+            subjects : list[str]
+                Names of the subjects (defaults to const.SUBJECTS).
+        """
+        self.years = years
+        self.caps = caps
+        self.quality = quality
+        self.course_subjects = course_subjects
+        self.student_subjects = student_subjects
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values
+        self.subjects = const.SUBJECTS if subjects is None else list(subjects)
+
+        self.n_students = len(years)
+        self.n_courses = len(caps)
+
+    @classmethod
+    def from_dense(cls, years, caps, quality, course_subjects, student_subjects, utilities, interest,
+                   subjects=None):
+        """
+            Build a population from (n_students x n_courses) utility and
+            interest arrays.
+        """
+        indptr, indices, values = dense_to_csr(utilities, interest)
+        return cls(years, caps, quality, course_subjects, student_subjects, indptr, indices, values,
+                   subjects)
+
+    def row(self, i):
+        """
+            Return (courses, values) of student i's interest pairs.
+        """
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return self.indices[start:end], self.values[start:end]
+
+    def value(self, i, j):
+        """
+            Return student i's value for course j (0 if not interested).
+        """
+        start, end = self.indptr[i], self.indptr[i + 1]
+        k = start + self.indices[start:end].searchsorted(j)
+        if k < end and self.indices[k] == j:
+            return self.values[k]
+        return 0.
+
+    def values_of(self, i, js):
+        """
+            Return student i's values for each course in js (0 if not interested).
+        """
+        courses, values = self.row(i)
+        js = np.asarray(js, dtype=int)
+        if not len(courses):
+            return np.zeros(len(js))
+        k = np.minimum(courses.searchsorted(js), len(courses) - 1)
+        return np.where(courses[k] == js, values[k], 0.)
+
+    def values_at(self, rows, columns):
+        """
+            Return student rows[k]'s value for course columns[k], for every k
+            (0 if not interested).
+        """
+        students, courses, values = self.pairs()
+        keys = students * self.n_courses + courses
+        query = np.asarray(rows, dtype=np.int64) * self.n_courses + np.asarray(columns)
+        if not len(keys):
+            return np.zeros(len(query))
+        k = np.minimum(keys.searchsorted(query), len(keys) - 1)
+        return np.where(keys[k] == query, values[k], 0.)
+
+    def pairs(self):
+        """
+            Return (students, courses, values) of every interest pair.
+        """
+        students = np.repeat(np.arange(self.n_students), np.diff(self.indptr))
+        return students, self.indices, self.values
+
+    def views(self):
+        """
+            Return Course and Student views over the population.
+        """
+        courses = [Course(self, j) for j in xrange(self.n_courses)]
+        students = [Student(self, i, courses) for i in xrange(self.n_students)]
+        return courses, students
+
+    def freeze(self):
+        """
+            Make the population's arrays read-only, so it can be shared by
+            every mechanism run on it. Returns the population.
+        """
+        for field in self.FIELDS:
+            getattr(self, field).flags.writeable = False
+        return self
+
+    def nbytes(self):
+        """
+            Return the # of bytes taken up by the population's arrays.
+        """
+        return sum(getattr(self, field).nbytes for field in self.FIELDS)
+
+    def save(self, path):
+        """
+            Write each array to path/<field>.npy and the subject names to
+            path/subjects.json, creating the directory.
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for field in self.FIELDS:
+            np.save(os.path.join(path, field + ".npy"), getattr(self, field))
+        with open(os.path.join(path, "subjects.json"), "w") as f:
+            json.dump(self.subjects, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """
+            Load a population written by save. By default the arrays are
+            memory-mapped read-only, so loading costs next to nothing and
+            pages are only read in as mechanisms touch them.
+        """
+        arrays = [np.load(os.path.join(path, field + ".npy"), mmap_mode=mmap_mode)
+                  for field in cls.FIELDS]
+        subjects = None
+        if os.path.exists(os.path.join(path, "subjects.json")):
+            with open(os.path.join(path, "subjects.json")) as f:
+                subjects = json.load(f)
+        return cls(*arrays, subjects=subjects)
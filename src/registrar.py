@@ -0,0 +1,159 @@
+"""Convert and load real registrar preference data.
+
+A preferences CSV has one row per ranked course, with a header naming the
+columns student, year, course and rank (1 = most preferred). A courses CSV
+has columns course and cap, and optionally subject.
+
+Conversion streams both files and writes a population directory (see
+Population.save) whose arrays are then memory-mapped by load. Students value
+a course by its Borda score, max_rank + 1 - rank, so higher is better.
+"""
+import argparse
+import csv
+import json
+import os
+
+import numpy as np
+
+from population import Population
+
+parser = argparse.ArgumentParser(description="Convert registrar preference CSVs to a population directory.")
+parser.add_argument("preferences", help="CSV of (student, year, course, rank) rows")
+parser.add_argument("courses", help="CSV of (course, cap[, subject]) rows")
+parser.add_argument("output", help="directory to write the population to")
+parser.add_argument("--chunk_size", type=int, default=100000,
+                    help="# of preference rows to buffer before writing them out")
+
+def _rows(path):
+    """
+        Stream the rows of a CSV file as dicts keyed by its header.
+    """
+    with open(path, "rb") as f:
+        for row in csv.DictReader(f):
+            yield row
+
+def read_courses(path):
+    """
+        Return (course ids, caps, subject of each course, subject names)
+        from a courses CSV.
+    """
+    course_ids, caps, course_subjects = [], [], []
+    subjects = {}
+    for row in _rows(path):
+        course_ids.append(row["course"])
+        caps.append(int(row["cap"]))
+        subject = row.get("subject") or "Unknown"
+        course_subjects.append(subjects.setdefault(subject, len(subjects)))
+    names = sorted(subjects, key=subjects.get)
+    return course_ids, np.array(caps, dtype=int), np.array(course_subjects, dtype=int), names
+
+def convert(preferences_path, courses_path, path, chunk_size=100000):
+    """
+        Write the population described by a preferences CSV and a courses CSV
+        to path. Memory use is bounded by the # of students and courses and
+        chunk_size, not the # of preference rows: the preferences are read
+        twice, once to number and count students' rows and once to fill in
+        disk-backed sparse arrays, which are then sorted a chunk at a time.
+    """
+    course_ids, caps, course_subjects, subjects = read_courses(courses_path)
+    course_index = dict((course, j) for j, course in enumerate(course_ids))
+
+    # First pass: number students, record their years, count their ranked
+    # courses and find the longest list
+    student_index = {}
+    years = []
+    counts = []
+    max_rank = 0
+    for row in _rows(preferences_path):
+        if row["course"] not in course_index:
+            raise ValueError("unknown course %r in %s" % (row["course"], preferences_path))
+        i = student_index.get(row["student"])
+        if i is None:
+            i = student_index[row["student"]] = len(years)
+            years.append(int(row["year"]))
+            counts.append(0)
+        counts[i] += 1
+        max_rank = max(max_rank, int(row["rank"]))
+
+    n_students, n_courses = len(years), len(course_ids)
+    indptr = np.r_[0, np.cumsum(counts, dtype=np.int64)].astype(np.int64)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    def array(name, dtype, shape):
+        return np.lib.format.open_memmap(os.path.join(path, name + ".npy"), "w+", dtype, shape)
+
+    indices = array("indices", np.int32, (indptr[-1],))
+    values = array("values", np.float64, (indptr[-1],))
+    student_subjects = array("student_subjects", np.bool_, (n_students, len(subjects)))
+
+    def flush(rows, positions, columns, ranks):
+        columns = np.array(columns, dtype=int)
+        indices[positions] = columns
+        values[positions] = max_rank + 1 - np.array(ranks, dtype=float)
+        student_subjects[rows, course_subjects[columns]] = True
+
+    # Second pass: write each preference to the next free slot of its
+    # student's row, a chunk at a time
+    fill = indptr[:-1].tolist()
+    rows, positions, columns, ranks = [], [], [], []
+    for row in _rows(preferences_path):
+        i = student_index[row["student"]]
+        rows.append(i)
+        positions.append(fill[i])
+        fill[i] += 1
+        columns.append(course_index[row["course"]])
+        ranks.append(int(row["rank"]))
+        if len(rows) >= chunk_size:
+            flush(rows, positions, columns, ranks)
+            rows, positions, columns, ranks = [], [], [], []
+    if rows:
+        flush(rows, positions, columns, ranks)
+
+    # Sort each row by course, over chunks of whole rows
+    start = 0
+    while start < n_students:
+        end = max(start + 1, np.searchsorted(indptr, indptr[start] + chunk_size, "right") - 1)
+        end = min(end, n_students)
+        lo, hi = indptr[start], indptr[end]
+        local_rows = np.repeat(np.arange(end - start), np.diff(indptr[start:end + 1]))
+        keys = local_rows * n_courses + indices[lo:hi]
+        order = np.argsort(keys, kind="mergesort")
+        if (np.diff(keys[order]) == 0).any():
+            raise ValueError("a student ranks the same course twice in %s" % preferences_path)
+        indices[lo:hi] = indices[lo:hi][order]
+        values[lo:hi] = values[lo:hi][order]
+        start = end
+
+    for memmap in (indices, values, student_subjects):
+        memmap.flush()
+    np.save(os.path.join(path, "indptr.npy"), indptr)
+
+    # Small per-student and per-course arrays; course quality isn't observed
+    np.save(os.path.join(path, "years.npy"), np.array(years, dtype=int))
+    np.save(os.path.join(path, "caps.npy"), caps)
+    np.save(os.path.join(path, "quality.npy"), np.zeros(n_courses))
+    np.save(os.path.join(path, "course_subjects.npy"), course_subjects)
+    with open(os.path.join(path, "subjects.json"), "w") as f:
+        json.dump(subjects, f)
+
+    student_ids = sorted(student_index, key=student_index.get)
+    np.save(os.path.join(path, "student_ids.npy"), np.array(student_ids, dtype=str))
+    np.save(os.path.join(path, "course_ids.npy"), np.array(course_ids, dtype=str))
+
+def load(path):
+    """
+        Return (population, student ids, course ids) for a converted
+        directory, with every array memory-mapped read-only.
+    """
+    population = Population.load(path)
+    student_ids = np.load(os.path.join(path, "student_ids.npy"), mmap_mode="r")
+    course_ids = np.load(os.path.join(path, "course_ids.npy"), mmap_mode="r")
+    return population, student_ids, course_ids
+
+def main():
+    args = parser.parse_args()
+    convert(args.preferences, args.courses, args.output, args.chunk_size)
+
+if __name__ == '__main__':
+    main()
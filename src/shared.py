@@ -0,0 +1,66 @@
+"""Share a population with pool workers through memory-mapped files.
+"""
+
+import os
+import shutil
+import tempfile
+
+from population import Population
+
+# (path, population) most recently attached in this process; only one is
+# kept, since a mapping keeps a removed file's pages alive
+_attached = [None, None]
+
+def shared_directory():
+    """
+        Return the directory to publish populations in: /dev/shm (memory
+        backed) where available, otherwise the temporary directory.
+    """
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+class SharedPopulation(object):
+    """
+        A population published as .npy files that workers memory-map instead
+        of receiving a pickled copy, so every process shares the same pages.
+        Only the path is pickled when a SharedPopulation is sent to a worker.
+    """
+
+    def __init__(self, population, directory=None):
+        """
+            Publish population under directory (see shared_directory).
+        """
+        self.path = tempfile.mkdtemp(dir=directory or shared_directory(), prefix="population-")
+        population.save(self.path)
+
+    def attach(self):
+        """
+            Return the published population, memory-mapped read-only. Each
+            process maps the files once and reuses the mapping until it
+            attaches to a different population.
+        """
+        if _attached[0] != self.path:
+            _attached[:] = [self.path, Population.load(self.path)]
+        return _attached[1]
+
+    def close(self):
+        """
+            Remove the published files. Processes that already attached keep
+            their mappings until they drop them.
+        """
+        if _attached[0] == self.path:
+            _attached[:] = [None, None]
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,15 +1,20 @@
 """Compare RandomLottery with RandomLottery+TTC
 """
 import argparse
-from copy import deepcopy
+import json
+from functools import partial
+from itertools import imap, izip
+from multiprocessing import Pool
 
 import numpy as np
 
 from ttc import TTC
-from course import Course
-from student import Student
+from cache import PopulationCache
 from factory import Factory
+from population import Population
 from lottery import RandomLottery
+from stats import RunningStats, Summary
+from tracing import NULL_TRACER, RecordingTracer, MemoryCollector, JsonLinesExporter
 
 parser = argparse.ArgumentParser(description='Process some integers.')
 parser.add_argument("--n_courses", type=int, default=10,
@@ -22,49 +27,244 @@ parser.add_argument("--max_cap", type=int, default=3,
                     help="maximum course enrollment cap")
 parser.add_argument("--iters", type=int, default=1,
                     help="# of iterations to run comparison")
+parser.add_argument("--cycle_selection", choices=["longest", "first"], default="longest",
+                    help="how TTC picks the cycle to trade in each SCC")
+parser.add_argument("--budget", type=int, default=None,
+                    help="max # of edges TTC traverses per SCC when enumerating cycles")
+parser.add_argument("--incremental", action="store_true",
+                    help="update the TTC graph incrementally between rounds")
+parser.add_argument("--pack_cycles", action="store_true",
+                    help="trade a maximal set of disjoint cycles per TTC round")
+parser.add_argument("--priority_keys", action="store_true",
+                    help="draw the random lottery with year-weighted priority keys in one pass")
+parser.add_argument("--target_ci", type=float, default=None,
+                    help="stop once the 95%% CIs on overall and mean individual improvement "
+                         "are this narrow (iters becomes the maximum)")
+parser.add_argument("--batch_size", type=int, default=10,
+                    help="# of iterations to run between checks against --target_ci")
+parser.add_argument("--workers", type=int, default=1,
+                    help="# of processes to run iterations in")
+parser.add_argument("--seed", type=int, default=None,
+                    help="master seed that every iteration's random state is derived from")
+parser.add_argument("--population", default=None,
+                    help="population directory (e.g. converted registrar data) to use instead of generating one")
+parser.add_argument("--cache_dir", default=None,
+                    help="directory to cache generated populations in across runs")
+parser.add_argument("--cache_size", type=int, default=2**30,
+                    help="max size of the population cache in bytes")
+parser.add_argument("--summary_file", default=None,
+                    help="file to append per-iteration summaries to (JSON lines)")
+parser.add_argument("--trace_file", default=None,
+                    help="file to append per-round phase timings and counters to (JSON lines)")
 
-def random_vs_ttc(n_courses, n_students, min_cap, max_cap, iters):
+def iteration_seeds(seed, iters):
     """
-        Compare RandomLottery outcome with RL+TTC outcome.
+        Derive a distinct, independent seed for every iteration from a master
+        seed, so results don't depend on how iterations are split across workers.
+    """
+    rng = np.random.RandomState(seed)
+    seeds = rng.randint(2**31 - 1, size=iters)
+
+    # Redraw repeats (keeping each seed's first occurrence) so no replication
+    # is silently run twice
+    while True:
+        repeated = np.ones(iters, dtype=bool)
+        repeated[np.unique(seeds, return_index=True)[1]] = False
+        if not repeated.any():
+            return seeds.tolist()
+        seeds[repeated] = rng.randint(2**31 - 1, size=repeated.sum())
+
+def run_iteration(seed, n_courses, n_students, min_cap, max_cap,
+                  cycle_selection, budget, incremental, pack_cycles, priority_keys=False,
+                  population=None, cache_dir=None, cache_size=2**30, trace=False):
+    """
+        Run RandomLottery and RL+TTC on a fresh population drawn from seed
+        (or loaded from the population cache in cache_dir), or on the
+        population stored in the directory population, if given.
+        Returns (RL utilities, TTC utilities, TTC stats, trace records).
     """
+    collector = MemoryCollector()
+    tracer = RecordingTracer(collector) if trace else NULL_TRACER
 
     f = Factory(n_courses, n_students, min_cap, max_cap)
+    if population is not None:
+        rng = np.random.RandomState(seed)
+        courses, students = Population.load(population).views()
+    elif cache_dir is not None:
+        courses, students, rng = PopulationCache(cache_dir, cache_size).generate(f, seed)
+    else:
+        rng = np.random.RandomState(seed)
+        courses, students = f.generate(rng=rng)
+
+    # Run the RandomLottery
+    rl = RandomLottery(courses, students, rng, tracer, priority_keys)
+    rl_students = rl.run()
+    rl_utils = [s.get_studycard_value() for s in rl.students]
+
+    # Run TTC on the output of RandomLottery in place (its welfare is already recorded)
+    ttc = TTC(rl_students, cycle_selection, budget, incremental, pack_cycles, rng, tracer)
+    ttc.run()
+    ttc_utils = [s.get_studycard_value() for s in ttc.students]
+
+    return rl_utils, ttc_utils, ttc.stats, collector.records
+
+def welfare_diffs(rl_utils, ttc_utils):
+    """
+        Return TTC's improvement over RandomLottery (%) in total welfare,
+        and for every student.
+    """
+    rl_utils = np.array(rl_utils, dtype=float)
+    ttc_utils = np.array(ttc_utils, dtype=float)
+    rl_welfare = rl_utils.sum()
+    ttc_welfare = ttc_utils.sum()
+    total_diff = (ttc_welfare - rl_welfare) / float(ttc_welfare + rl_welfare) * 100
+
+    both = ttc_utils + rl_utils
+    student_diff = np.zeros(len(both))
+    np.divide((ttc_utils - rl_utils) * 100, both, out=student_diff, where=both != 0)
+    return total_diff, student_diff
+
+def precise_enough(target_ci, *stats):
+    """
+        Return whether every RunningStats' 95% confidence interval on the
+        mean is at most target_ci wide.
+    """
+    return all(s.ci_width() <= target_ci for s in stats)
+
+def format_ci(stats):
+    """
+        Format a RunningStats' 95% confidence interval on the mean for printing.
+    """
+    return "[%.4f, %.4f]" % stats.confidence_interval()
+
+def format_quantiles(summary):
+    """
+        Format a Summary's quantile estimates for printing.
+    """
+    return ", ".join("p%d: %.4f" % (p * 100, q) for p, q in summary.quantiles())
+
+def random_vs_ttc(n_courses, n_students, min_cap, max_cap, iters,
+                  cycle_selection="longest", budget=None, incremental=False,
+                  pack_cycles=False, priority_keys=False, workers=1, seed=None,
+                  population=None, cache_dir=None, cache_size=2**30, summary_file=None,
+                  trace_file=None, target_ci=None, batch_size=10):
+    """
+        Compare RandomLottery outcome with RL+TTC outcome.
+        Results are aggregated as they stream in, so memory doesn't grow with iters;
+        per-iteration summaries are appended to summary_file as JSON lines if given,
+        and per-round mechanism traces to trace_file.
+        With target_ci, iterations run in batches of batch_size and stop early once
+        the 95% CIs on overall and mean individual improvement are that narrow.
+    """
+    iteration = partial(
+        run_iteration,
+        n_courses=n_courses,
+        n_students=n_students,
+        min_cap=min_cap,
+        max_cap=max_cap,
+        cycle_selection=cycle_selection,
+        budget=budget,
+        incremental=incremental,
+        pack_cycles=pack_cycles,
+        priority_keys=priority_keys,
+        population=population,
+        cache_dir=cache_dir,
+        cache_size=cache_size,
+        trace=trace_file is not None
+    )
+    seeds = iteration_seeds(seed, iters)
+
+    if target_ci is None:
+        batch_size = len(seeds)
+    batch_size = max(2, batch_size)
+
+    pool = Pool(workers) if workers > 1 else None
+
+    student_diffs = Summary()
+    total_diffs = Summary()
+    mean_student_diffs = Summary()
+    ttc_rounds = RunningStats()
+    n_sccs = 0
+    n_exhausted = 0
 
-    student_diffs = []
-    total_diffs = []
-    mean_student_diffs = []
-    for i in xrange(iters):
-        courses, students = f.generate()
-
-        # Run the RandomLottery
-        rl = RandomLottery(courses, students)
-        rl_students = rl.run()
-        rl_utils = [s.get_studycard_value() for s in rl.students]
-        rl_welfare = sum(rl_utils)
-
-        # Run TTC on the output of RandomLottery
-        ttc = TTC(deepcopy(rl_students))
-        ttc.run()
-        ttc_utils = [s.get_studycard_value() for s in ttc.students]
-        ttc_welfare = sum(ttc_utils)
-        
-        # Compute summary statistics
-        total_diff = (ttc_welfare - rl_welfare) / float(ttc_welfare + rl_welfare) * 100
-        total_diffs.append(total_diff)
-        student_diff = [(t - r) / float(t + r) * 100 if t +
-                        r else 0 for t, r in zip(ttc_utils, rl_utils)]
-        student_diffs.append(student_diff)
-        mean_student_diff = np.mean(student_diff)
-        mean_student_diffs.append(mean_student_diff)
+    summary = open(summary_file, "w") if summary_file else None
+    trace = JsonLinesExporter(trace_file) if trace_file else None
+    i = 0
+    for start in xrange(0, len(seeds), batch_size):
+        batch = seeds[start:start + batch_size]
+        if pool is not None:
+            results = pool.imap(iteration, batch, chunksize=max(1, len(batch) // (4 * workers)))
+        else:
+            results = imap(iteration, batch)
+
+        for seed, (rl_utils, ttc_utils, stats, records) in izip(batch, results):
+            n_sccs += stats["sccs"]
+            n_exhausted += stats["budget_exhausted"]
+            ttc_rounds.update(stats["rounds"])
+
+            # Compute summary statistics
+            total_diff, student_diff = welfare_diffs(rl_utils, ttc_utils)
+            total_diffs.update(total_diff)
+            student_diffs.update_many(student_diff)
+            mean_student_diff = student_diff.mean() if len(student_diff) else 0.
+            mean_student_diffs.update(mean_student_diff)
+
+            # Flush this iteration's summary so memory doesn't grow with iters
+            if summary is not None:
+                summary.write(json.dumps({
+                    "iteration": i,
+                    "seed": seed,
+                    "total_diff": total_diff,
+                    "mean_student_diff": mean_student_diff,
+                    "rounds": stats["rounds"],
+                }) + "\n")
+                summary.flush()
+
+            if trace is not None:
+                for record in records:
+                    record["iteration"] = i
+                    trace(record)
+            i += 1
+
+        if target_ci is not None and precise_enough(target_ci, total_diffs.stats,
+                                                    mean_student_diffs.stats):
+            break
+
+    if summary is not None:
+        summary.close()
+    if trace is not None:
+        trace.close()
+
+    if pool is not None:
+        pool.close()
+        pool.join()
     
     print
     print "=========================================="
     print "Overall Welfare Improvement (%): "
-    print "mean: ", np.mean(total_diffs), "std: ", np.std(total_diffs)
+    print "mean: ", total_diffs.stats.mean, "std: ", total_diffs.stats.std()
+    print "quantiles: ", format_quantiles(total_diffs)
+    print "95% CI: ", format_ci(total_diffs.stats)
     print "=========================================="
     print "Mean Individual Welfare Improvement (%):"
-    print "mean: ", np.mean(mean_student_diffs), "std: ", np.std(mean_student_diffs)
+    print "mean: ", mean_student_diffs.stats.mean, "std: ", mean_student_diffs.stats.std()
+    print "quantiles: ", format_quantiles(mean_student_diffs)
+    print "95% CI: ", format_ci(mean_student_diffs.stats)
+    print "=========================================="
+    print "Individual Welfare Improvement (%):"
+    print "mean: ", student_diffs.stats.mean, "std: ", student_diffs.stats.std()
+    print "quantiles: ", format_quantiles(student_diffs)
+    print "=========================================="
+    if target_ci is not None:
+        reached = precise_enough(target_ci, total_diffs.stats, mean_student_diffs.stats)
+        print "Iterations: ", i, "of", iters, "(target CI width %s)" % ("reached" if reached else "not reached")
+        print "=========================================="
+    print "TTC Rounds to Convergence:"
+    print "mean: ", ttc_rounds.mean, "max: ", ttc_rounds.max
     print "=========================================="
+    if budget is not None:
+        print "Cycle enumeration cut short by budget in", n_exhausted, "of", n_sccs, "SCCs"
+        print "=========================================="
     print
 
     return student_diffs, total_diffs, mean_student_diffs
@@ -76,7 +276,21 @@ def main():
         args.n_students, 
         args.min_cap,
         args.max_cap,
-        args.iters
+        args.iters,
+        args.cycle_selection,
+        args.budget,
+        args.incremental,
+        args.pack_cycles,
+        args.priority_keys,
+        args.workers,
+        args.seed,
+        args.population,
+        args.cache_dir,
+        args.cache_size,
+        args.summary_file,
+        args.trace_file,
+        args.target_ci,
+        args.batch_size
     )
 
 if __name__ == '__main__':
@@ -0,0 +1,214 @@
+"""Streaming summary statistics for simulation results.
+"""
+
+import math
+
+import numpy as np
+
+class RunningStats(object):
+    """
+        Running count, mean and variance (Welford's algorithm), in constant memory.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def update(self, x):
+        """
+            Add one observation.
+        """
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    def update_many(self, xs):
+        """
+            Add a batch of observations (merged with Chan et al.'s parallel update).
+        """
+        xs = np.asarray(xs, dtype=float)
+        if not len(xs):
+            return
+        other = RunningStats()
+        other.n = len(xs)
+        other.mean = xs.mean()
+        other.m2 = ((xs - other.mean) ** 2).sum()
+        other.min = xs.min()
+        other.max = xs.max()
+        self.merge(other)
+
+    def merge(self, other):
+        """
+            Fold another RunningStats into this one.
+        """
+        if not other.n:
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta ** 2 * self.n * other.n / n
+        self.n = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def variance(self, ddof=0):
+        """
+            Return the variance (population variance by default, like np.var).
+        """
+        if self.n <= ddof:
+            return float("nan")
+        return self.m2 / (self.n - ddof)
+
+    def std(self, ddof=0):
+        """
+            Return the standard deviation (population by default, like np.std).
+        """
+        return math.sqrt(self.variance(ddof))
+
+    def sem(self):
+        """
+            Return the standard error of the mean (from the sample standard deviation).
+        """
+        return math.sqrt(self.variance(ddof=1) / self.n) if self.n > 1 else float("nan")
+
+    def ci_width(self, z=1.96):
+        """
+            Return the full width of the normal-approximation confidence
+            interval on the mean (95% by default).
+        """
+        return 2 * z * self.sem()
+
+    def confidence_interval(self, z=1.96):
+        """
+            Return (low, high) of the normal-approximation confidence interval
+            on the mean (95% by default).
+        """
+        half = z * self.sem()
+        return self.mean - half, self.mean + half
+
+
+class HistogramSketch(object):
+    """
+        Estimate quantiles in constant memory from a histogram with a fixed
+        # of equal-width bins. Observations are binned a batch at a time with
+        np.bincount; when a batch falls outside the covered range, the range
+        is doubled (merging pairs of bins) until it fits. Until there are
+        more observations than bins they're kept, and quantiles are exact.
+    """
+
+    def __init__(self, n_bins=4096):
+        """
+            params
+            ------
+            n_bins : int
+                # of histogram bins (even); quantile estimates are within one
+                bin width of the truth.
+        """
+        self.n_bins = n_bins
+        self.n = 0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.observations = []
+        self.counts = None
+        self.lo = None
+        self.width = None
+
+    def update(self, x):
+        """
+            Add one observation.
+        """
+        self.update_many([x])
+
+    def update_many(self, xs):
+        """
+            Add a batch of observations.
+        """
+        xs = np.asarray(xs, dtype=float).ravel()
+        if not len(xs):
+            return
+        self.n += len(xs)
+        self.min = min(self.min, xs.min())
+        self.max = max(self.max, xs.max())
+
+        if self.counts is None:
+            self.observations.append(xs)
+            if self.n <= self.n_bins:
+                return
+            xs = np.concatenate(self.observations)
+            self.observations = []
+            self.counts = np.zeros(self.n_bins, dtype=np.int64)
+            self.lo = xs.min()
+            if xs.max() > self.lo:
+                self.width = (xs.max() - self.lo) / (self.n_bins - 1)
+            else:
+                self.width = max(abs(self.lo), 1.) / self.n_bins
+
+        while xs.min() < self.lo or xs.max() >= self.lo + self.width * self.n_bins:
+            self._widen(xs.min() < self.lo)
+
+        bins = np.minimum(((xs - self.lo) / self.width).astype(np.int64), self.n_bins - 1)
+        self.counts += np.bincount(bins, minlength=self.n_bins)
+
+    def _widen(self, downwards):
+        """
+            Double the range covered by the bins, extending it downwards or
+            upwards.
+        """
+        half = self.n_bins // 2
+        merged = self.counts[0::2] + self.counts[1::2]
+        self.counts = np.zeros(self.n_bins, dtype=np.int64)
+        if downwards:
+            self.counts[half:] = merged
+            self.lo -= self.width * self.n_bins
+        else:
+            self.counts[:half] = merged
+        self.width *= 2
+
+    def quantile(self, p):
+        """
+            Return the estimate of the p quantile (0 to 1).
+        """
+        if not self.n:
+            return float("nan")
+        if self.counts is None:
+            return float(np.percentile(np.concatenate(self.observations), p * 100))
+
+        # Interpolate linearly within the bin holding the p * n'th observation
+        cumulative = np.cumsum(self.counts)
+        target = p * self.n
+        k = min(int(np.searchsorted(cumulative, target)), self.n_bins - 1)
+        below = cumulative[k - 1] if k else 0
+        fraction = (target - below) / float(self.counts[k]) if self.counts[k] else 0.
+        estimate = self.lo + (k + fraction) * self.width
+        return float(min(max(estimate, self.min), self.max))
+
+
+class Summary(object):
+    """
+        Running mean/std plus a set of tracked quantiles.
+    """
+
+    def __init__(self, quantiles=(0.1, 0.5, 0.9)):
+        self.stats = RunningStats()
+        self.sketch = HistogramSketch()
+        self.ps = quantiles
+
+    def update(self, x):
+        self.stats.update(x)
+        self.sketch.update(x)
+
+    def update_many(self, xs):
+        self.stats.update_many(xs)
+        self.sketch.update_many(xs)
+
+    def quantiles(self):
+        """
+            Return [(p, estimate)] for each tracked quantile.
+        """
+        return [(p, self.sketch.quantile(p)) for p in self.ps]
@@ -1,66 +1,95 @@
 """Implements the student class
 """
 
-from random import random, randint, sample
-from collections import defaultdict
+from bisect import insort
 
-from numpy.random import normal
+import numpy as np
 
 import constants as const
 
+def _student(cls, index):
+    """
+        Create a student with only its index set, for copy and pickle.
+    """
+    student = cls.__new__(cls)
+    student.index = index
+    return student
+
 class Student(object):
     """
         A student with course preferences.
     """
+    __slots__ = ("population", "index", "courses", "_order", "_n_preferences", "_card",
+                 "_card_value", "offered_courses", "enrolled_courses")
 
-    def __init__(self, year, courses, noise=const.NOISE):
+    def __init__(self, population, index, courses):
         """
             params
             ------
-            year : int
-                1, 2, 3, or 4.
+            population : Population
+                The population this student belongs to.
+            index : int
+                The student's row in the population's arrays.
             courses : list[Course]
                 List of courses to choose from.
         """
-        self.year = year
-        self.noise = noise
+        self.population = population
+        self.index = index
         self.courses = courses
 
-        # Randomly choose subjects to be interested in
-        self.subjects = set(
-            sample(const.SUBJECTS, randint(const.MIN_SUBJECTS, const.MAX_SUBJECTS))
-        )
-
-        self.interested = set()
-        self.preferences = []
-        self.preference_dict = {}
-        self._init_preferences()
+        # Courses ordered by increasing preference (built lazily, for TTC),
+        # and the number of them that haven't been enrolled in yet
+        self._order = None
+        self._n_preferences = 0
 
+        # Offered and enrolled courses change through offer_spot and
+        # remove_spot (or move between the two), which keep the study card current
         self.offered_courses = set()
         self.enrolled_courses = set()
 
+        # Every offered or enrolled course as (-value, number, course), most
+        # valuable first, and the total value of the first MAX_COURSES
+        self._card = []
+        self._card_value = 0.
+
+    @property
+    def year(self):
+        return int(self.population.years[self.index])
+
+    @property
+    def subjects(self):
+        mask = self.population.student_subjects[self.index]
+        return set(self.population.subjects[k] for k in np.flatnonzero(mask))
+
+    @property
+    def interested(self):
+        courses, _ = self.population.row(self.index)
+        return set(self.courses[j] for j in courses)
+
+    @property
+    def preferences(self):
+        """
+            Remaining (course, value) pairs, sorted by increasing value.
+        """
+        self._init_preferences()
+        order = self._order[:self._n_preferences]
+        values = self.population.values_of(self.index, order)
+        return [(self.courses[j], value) for j, value in zip(order, values)]
+
     def _init_preferences(self):
         """
-            Initialize students' preferences over the given courses.
+            Sort the courses the student is interested in by preference.
+        """
+        if self._order is None:
+            courses, values = self.population.row(self.index)
+            self._order = courses[np.argsort(values, kind="mergesort")]
+            self._n_preferences = len(self._order)
 
-            params
-            ------
-            n_courses : int
-                The number of courses to choose from.
-        """
-        for course in self.courses:
-            # If student is interested in course's subject
-            if course.subject in self.subjects:
-                # Student's value is normally distributed around course quality
-                value = course.quality + normal(scale=self.noise)
-                # Only lottery for courses with positive value
-                if value >= 0:
-                    self.interested.add(course)
-                    self.preferences.append((course, value))
-
-        # Sort courses by highest preference
-        self.preferences.sort(key=lambda c: c[1])
-        self.preference_dict = defaultdict(int, dict(self.preferences))
+    def value(self, course):
+        """
+            Return the student's value for a course (0 if not interested).
+        """
+        return self.population.value(self.index, course.number)
 
     def init_trading(self):
         """
@@ -75,35 +104,51 @@ class Student(object):
             Enroll in all courses that shouldn't be traded away.
         """
         # Enroll in any offered courses that are top-preferred
-        while (self.preferences
-               and self.has_room()
-               and self.preferences[-1][0] in self.offered_courses):
-            self.enrolled_courses.add(self.preferences[-1][0])
-            self.offered_courses.remove(self.preferences[-1][0])
-            self.preferences.pop()
+        top = self.top_preference()
+        while top is not None and self.has_room() and top in self.offered_courses:
+            self.enrolled_courses.add(top)
+            self.offered_courses.remove(top)
+            self._n_preferences -= 1
+            top = self.top_preference()
 
     def top_preference(self):
         """
             Get student's top preferred course that they haven't been offered. 
             (For use by TTC)
         """
-        if self.preferences:
-            return self.preferences[-1][0]
+        self._init_preferences()
+        if self._n_preferences:
+            return self.courses[self._order[self._n_preferences - 1]]
 
     def offer_spot(self, course):
         """
             How a Course offers a spot to a Student.
         """
+        if course not in self.offered_courses and course not in self.enrolled_courses:
+            insort(self._card, (-self.value(course), course.number, course))
+            self._update_card_value()
         self.offered_courses.add(course)
 
     def get_studycard(self):
         """
             View MAX_COURSES most valuable offered courses.
         """
-        all_courses = list(self.offered_courses.union(self.enrolled_courses))
-        all_courses.sort(key=lambda c: self.preference_dict[c], reverse=True)
-        accepts = all_courses[0:const.MAX_COURSES]
-        return accepts
+        return [course for _, _, course in self._card[:const.MAX_COURSES]]
+
+    def _update_card_value(self):
+        """
+            Recompute the cached value of the study card.
+        """
+        self._card_value = sum([-key for key, _, _ in self._card[:const.MAX_COURSES]])
+
+    def _reset_card(self):
+        """
+            Rebuild the study card after offered and enrolled courses were
+            replaced wholesale.
+        """
+        held = self.offered_courses.union(self.enrolled_courses)
+        self._card = sorted((-self.value(c), c.number, c) for c in held)
+        self._update_card_value()
 
     def get_studycard_destructive(self):
         """
@@ -140,13 +185,18 @@ class Student(object):
         """
         if course in self.offered_courses:
             self.offered_courses.remove(course)
+            if course not in self.enrolled_courses:
+                for k, (_, _, held) in enumerate(self._card):
+                    if held is course:
+                        del self._card[k]
+                        break
+                self._update_card_value()
 
     def get_studycard_value(self):
         """
             Return total utility of study card to student.
         """
-        studycard = self.get_studycard()
-        return sum([self.preference_dict[c] for c in studycard])
+        return self._card_value
 
     def has_room(self):
         """
@@ -154,5 +204,19 @@ class Student(object):
         """
         return len(self.enrolled_courses) < const.MAX_COURSES
 
+    def __hash__(self):
+        # Hash by row so set iteration order doesn't depend on memory layout
+        return self.index
+
+    def __reduce__(self):
+        # Set index before the rest of the state, which may hold sets that
+        # contain this student (e.g. through its courses), so it can be hashed
+        state = dict((name, getattr(self, name)) for name in self.__slots__)
+        return _student, (self.__class__, self.index), state
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
     def __repr__(self):
          return str(self.__hash__())
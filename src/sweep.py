@@ -0,0 +1,213 @@
+"""Sweep RandomLottery vs RL+TTC over a grid of parameters.
+
+Every cell of the grid is run in a worker process that stays up for many
+cells, with constants.py overridden in-process for the cell. Finished cells
+are appended to a JSON-lines results store as they complete, and cells
+already in the store are skipped, so an interrupted sweep picks up where it
+left off.
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+from multiprocessing import Pool
+
+import constants as const
+from sim import iteration_seeds, precise_enough, run_iteration, welfare_diffs
+from stats import RunningStats
+
+# Sweepable parameters: name -> (type, default)
+PARAMS = {
+    "n_courses": (int, 10),
+    "n_students": (int, 30),
+    "min_cap": (int, 2),
+    "max_cap": (int, 3),
+    "n_subjects": (int, const.N_SUBJECTS),
+    "max_courses": (int, const.MAX_COURSES),
+    "noise": (float, const.NOISE),
+}
+
+# Parameters that live in constants.py
+CONSTANTS = {
+    "n_subjects": "N_SUBJECTS",
+    "max_courses": "MAX_COURSES",
+    "noise": "NOISE",
+}
+
+parser = argparse.ArgumentParser(description="Sweep RandomLottery vs RL+TTC over a parameter grid.")
+parser.add_argument("results", help="JSON lines file to checkpoint finished cells to (and resume from)")
+parser.add_argument("--grid", action="append", default=[], metavar="NAME=V1,V2,...",
+                    help="values to sweep a parameter over (one of %s)" % ", ".join(sorted(PARAMS)))
+parser.add_argument("--iters", type=int, default=10,
+                    help="# of iterations per cell")
+parser.add_argument("--target_ci", type=float, default=None,
+                    help="stop a cell once the 95%% CIs on overall and mean individual improvement "
+                         "are this narrow (iters becomes the maximum)")
+parser.add_argument("--batch_size", type=int, default=10,
+                    help="# of iterations to run between checks against --target_ci")
+parser.add_argument("--seed", type=int, default=0,
+                    help="master seed; every cell runs the same iteration seeds")
+parser.add_argument("--cycle_selection", choices=["longest", "first"], default="longest",
+                    help="how TTC picks the cycle to trade in each SCC")
+parser.add_argument("--budget", type=int, default=None,
+                    help="max # of edges TTC traverses per SCC when enumerating cycles")
+parser.add_argument("--priority_keys", action="store_true",
+                    help="draw the random lottery with year-weighted priority keys in one pass")
+parser.add_argument("--workers", type=int, default=1,
+                    help="# of worker processes to run cells in")
+
+def parse_grid(specs):
+    """
+        Parse NAME=V1,V2,... specs into an ordered list of (name, values).
+    """
+    grid = []
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        if name not in PARAMS or not values:
+            raise ValueError("bad grid spec %r" % spec)
+        kind = PARAMS[name][0]
+        grid.append((name, [kind(v) for v in values.split(",")]))
+    return grid
+
+def cells(grid):
+    """
+        Return every cell of the grid as a dict of all sweepable parameters.
+    """
+    defaults = dict((name, kind(default)) for name, (kind, default) in PARAMS.items())
+    names = [name for name, _ in grid]
+    return [dict(defaults, **dict(zip(names, values)))
+            for values in itertools.product(*[values for _, values in grid])]
+
+def cell_key(cell, settings):
+    """
+        Return the string identifying a cell run with settings in the store.
+    """
+    # Coerce values so e.g. noise 4 and 4.0 (from older stores) are the same cell
+    params = dict((name, PARAMS[name][0](value) if name in PARAMS else value)
+                  for name, value in cell.items())
+    return json.dumps({"params": params, "settings": settings}, sort_keys=True)
+
+def completed(path):
+    """
+        Return the keys of the cells already in the results store.
+    """
+    keys = set()
+    if not os.path.exists(path):
+        return keys
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Partially written line from an interrupted sweep
+                continue
+            keys.add(cell_key(record["params"], record["settings"]))
+    return keys
+
+def run_cell(cell, settings):
+    """
+        Run settings["iters"] iterations of one cell (or fewer, once
+        settings["target_ci"] is reached), with its constants overridden for
+        the duration, and return its results record.
+    """
+    target_ci = settings.get("target_ci")
+    batch_size = max(2, settings.get("batch_size", 2))
+    start = time.time()
+    previous = const.configure(**dict((CONSTANTS[name], cell[name]) for name in CONSTANTS))
+    try:
+        total_diffs = RunningStats()
+        mean_student_diffs = RunningStats()
+        rounds = RunningStats()
+        for seed in iteration_seeds(settings["seed"], settings["iters"]):
+            rl_utils, ttc_utils, stats, _ = run_iteration(
+                seed, cell["n_courses"], cell["n_students"], cell["min_cap"], cell["max_cap"],
+                settings["cycle_selection"], settings["budget"], False, False,
+                settings["priority_keys"]
+            )
+            total_diff, student_diff = welfare_diffs(rl_utils, ttc_utils)
+            total_diffs.update(total_diff)
+            mean_student_diffs.update(student_diff.mean() if len(student_diff) else 0.)
+            rounds.update(stats["rounds"])
+            if (target_ci is not None and total_diffs.n % batch_size == 0
+                    and precise_enough(target_ci, total_diffs, mean_student_diffs)):
+                break
+    finally:
+        const.configure(**previous)
+
+    return {
+        "params": cell,
+        "settings": settings,
+        "total_diff": {"mean": total_diffs.mean, "std": total_diffs.std()},
+        "mean_student_diff": {"mean": mean_student_diffs.mean, "std": mean_student_diffs.std()},
+        "rounds": {"mean": rounds.mean, "max": rounds.max},
+        "iterations": total_diffs.n,
+        "seconds": time.time() - start,
+    }
+
+def _run_cell(args):
+    return run_cell(*args)
+
+def sweep(results, grid, iters=10, seed=0, cycle_selection="longest", budget=None,
+          priority_keys=False, workers=1, target_ci=None, batch_size=10):
+    """
+        Run every cell of grid not already in the results store, appending
+        each cell's record to the store as soon as it finishes.
+    """
+    settings = {
+        "iters": iters,
+        "seed": seed,
+        "cycle_selection": cycle_selection,
+        "budget": budget,
+        "priority_keys": priority_keys,
+    }
+    if target_ci is not None:
+        settings["target_ci"] = target_ci
+        settings["batch_size"] = batch_size
+    done = completed(results)
+    grid_cells = cells(grid)
+    todo = [cell for cell in grid_cells if cell_key(cell, settings) not in done]
+    print "%d of %d cells already done" % (len(grid_cells) - len(todo), len(grid_cells))
+
+    pool = None
+    if workers > 1:
+        pool = Pool(workers)
+        records = pool.imap_unordered(_run_cell, [(cell, settings) for cell in todo])
+    else:
+        records = itertools.imap(_run_cell, [(cell, settings) for cell in todo])
+
+    with open(results, "a+") as store:
+        # Start on a fresh line if the last write was interrupted
+        store.seek(0, os.SEEK_END)
+        if store.tell():
+            store.seek(-1, os.SEEK_END)
+            if store.read(1) != "\n":
+                store.write("\n")
+        for record in records:
+            store.write(json.dumps(record, sort_keys=True) + "\n")
+            store.flush()
+            os.fsync(store.fileno())
+            print ", ".join("%s=%s" % item for item in sorted(record["params"].items())), \
+                "total_diff: %.4f" % record["total_diff"]["mean"], "iterations: %d" % record["iterations"]
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+def main():
+    args = parser.parse_args()
+    sweep(
+        args.results,
+        parse_grid(args.grid),
+        args.iters,
+        args.seed,
+        args.cycle_selection,
+        args.budget,
+        args.priority_keys,
+        args.workers,
+        args.target_ci,
+        args.batch_size
+    )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Tests for TTC graph construction and cycle enumeration.
+
+Run from src/ with python -m unittest test_ttc
+"""
+import random
+import unittest
+
+import numpy as np
+
+from factory import Factory
+from lottery import RandomLottery
+from ttc import TTC
+
+def canonical(cycle):
+    """
+        Rotate a cycle to start at its smallest node.
+    """
+    k = cycle.index(min(cycle))
+    return tuple(cycle[k:] + cycle[:k])
+
+def brute_force_cycles(subgraph, scc):
+    """
+        Return every elementary cycle of subgraph restricted to scc, found
+        by extending each path from its smallest node.
+    """
+    nodes = set(scc)
+    cycles = set()
+    for root in nodes:
+        stack = [[root]]
+        while stack:
+            path = stack.pop()
+            for child in subgraph[path[-1]]:
+                if child == root:
+                    cycles.add(canonical(path))
+                elif child in nodes and child > root and child not in path:
+                    stack.append(path + [child])
+    return cycles
+
+def random_scc(rng, n, p):
+    """
+        Return a random graph on range(n) in which every node lies on the
+        cycle 0 -> 1 -> ... -> n - 1 -> 0, so the whole graph is one SCC.
+    """
+    subgraph = dict((node, [(node + 1) % n]) for node in xrange(n))
+    for node in xrange(n):
+        for child in xrange(n):
+            if child != node and child != (node + 1) % n and rng.random() < p:
+                subgraph[node].append(child)
+        rng.shuffle(subgraph[node])
+    scc = range(n)
+    rng.shuffle(scc)
+    return subgraph, scc
+
+def legacy_build_graph(students):
+    """
+        The original list-based TTC graph builder, kept as a reference.
+    """
+    graph = {}
+
+    nodes = []
+    for student in students:
+        student._update_preferences()
+        if student.has_room() and student.offered_courses:
+            nodes.append(student)
+
+    for student in nodes:
+        children = [
+            s for s in nodes
+            if student.top_preference() in s.offered_courses
+            and s != student
+        ]
+        if children:
+            graph[student] = children
+        else:
+            for k, v in graph.iteritems():
+                if student in v:
+                    v.remove(student)
+                graph[k] = v
+            nodes.remove(student)
+
+    for student in nodes:
+        try:
+            sanitized_children = [
+                c for c in graph[student]
+                if c in graph
+                and student.top_preference() in c.offered_courses
+            ]
+            graph[student] = sanitized_children
+        except KeyError:
+            student.get_studycard_destructive()
+
+    return graph
+
+def lottery_state(seed, n_courses, n_students, min_cap, max_cap):
+    """
+        Return the students of a population after the random lottery, set up
+        for TTC.
+    """
+    rng = np.random.RandomState(seed)
+    population = Factory(n_courses, n_students, min_cap, max_cap).generate_population(rng)
+    courses, students = population.views()
+    RandomLottery(courses, students, rng).run()
+    return TTC(students)
+
+def state(ttc):
+    """
+        Return every student's and course's holdings by position.
+    """
+    students = [(sorted(c.number for c in s.offered_courses),
+                 sorted(c.number for c in s.enrolled_courses)) for s in ttc.students]
+    courses = [(sorted(s.index for s in c.enrolled), c.n_enrolled) for c in ttc.courses]
+    return students, courses
+
+def by_index(graph):
+    return [(s.index, [c.index for c in children]) for s, children in graph.items()]
+
+class BuildGraphTest(unittest.TestCase):
+
+    def test_matches_legacy_builder(self):
+        for seed in xrange(100):
+            for sizes in [(10, 30, 2, 3), (20, 100, 3, 8)]:
+                indexed, legacy = lottery_state(seed, *sizes), lottery_state(seed, *sizes)
+                self.assertEqual(by_index(indexed._build_graph()),
+                                 by_index(legacy_build_graph(legacy.students)))
+                self.assertEqual(state(indexed), state(legacy))
+
+class JohnsonTest(unittest.TestCase):
+
+    def check(self, subgraph, scc):
+        cycles, exhausted = TTC._scc_to_cycles_johnson(subgraph, scc)
+        self.assertFalse(exhausted)
+        found = [canonical(cycle) for cycle in cycles]
+        self.assertEqual(len(found), len(set(found)))
+        self.assertEqual(set(found), brute_force_cycles(subgraph, scc))
+
+    def test_cycle_left_blocked_after_earlier_cycle(self):
+        subgraph = {0: [3], 1: [0, 3, 4, 2], 2: [1], 3: [0, 4, 1], 4: [0]}
+        self.check(subgraph, [2, 1, 4, 3, 0])
+
+    def test_matches_brute_force(self):
+        rng = random.Random(0)
+        for _ in xrange(400):
+            n = rng.randint(1, 7)
+            self.check(*random_scc(rng, n, rng.choice([0.2, 0.4, 0.7])))
+
+if __name__ == '__main__':
+    unittest.main()
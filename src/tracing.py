@@ -0,0 +1,123 @@
+"""Instrumentation hooks for mechanisms: per-phase timers, counters and exporters.
+"""
+
+import json
+from collections import defaultdict
+from timeit import default_timer
+
+class _NullPhase(object):
+    """
+        A phase timer that does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_PHASE = _NullPhase()
+
+class Tracer(object):
+    """
+        The disabled tracer: every hook is a no-op.
+        Mechanisms check `enabled` before computing anything only needed for tracing.
+    """
+    enabled = False
+
+    def phase(self, name):
+        """
+            Return a context manager timing the named phase.
+        """
+        return _NULL_PHASE
+
+    def count(self, name, n=1):
+        """
+            Add n to the named counter.
+        """
+
+    def end_round(self, source, round):
+        """
+            Export the phases and counters recorded since the last round.
+        """
+
+NULL_TRACER = Tracer()
+
+class _Phase(object):
+    """
+        Adds the time spent inside a `with` block to a tracer's phase total.
+    """
+
+    def __init__(self, phases, name):
+        self.phases = phases
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, *exc):
+        self.phases[self.name] += default_timer() - self.start
+        return False
+
+class RecordingTracer(Tracer):
+    """
+        A tracer that hands one record per round to each of its exporters:
+        {"source": ..., "round": ..., "phases": {name: seconds}, "counters": {name: n}}
+    """
+    enabled = True
+
+    def __init__(self, *exporters):
+        """
+            params
+            ------
+            exporters : callable(dict)
+                Called with every round's record.
+        """
+        self.exporters = exporters
+        self._phases = defaultdict(float)
+        self._counters = defaultdict(int)
+
+    def phase(self, name):
+        return _Phase(self._phases, name)
+
+    def count(self, name, n=1):
+        self._counters[name] += n
+
+    def end_round(self, source, round):
+        record = {
+            "source": source,
+            "round": round,
+            "phases": dict(self._phases),
+            "counters": dict(self._counters),
+        }
+        self._phases.clear()
+        self._counters.clear()
+        for exporter in self.exporters:
+            exporter(record)
+
+class MemoryCollector(object):
+    """
+        An exporter that keeps every record in a list.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record):
+        self.records.append(record)
+
+class JsonLinesExporter(object):
+    """
+        An exporter that writes every record to a file as a line of JSON.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "a")
+
+    def __call__(self, record):
+        self.file.write(json.dumps(record, sort_keys=True) + "\n")
+
+    def close(self):
+        self.file.close()
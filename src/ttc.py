@@ -1,15 +1,47 @@
 """Implements a variant of the Top Trading-Cycles algorithm.
 """
-from copy import deepcopy
-from random import choice
 from collections import defaultdict
 
+import numpy as np
+
+from allocation import Allocation
+from graph import to_csr, strongly_connected_components
+from tracing import NULL_TRACER
+
 class TTC:
     """
         Run TTC on a list of students.
     """
 
-    def __init__(self, students):
+    def __init__(self, students, cycle_selection="longest", budget=None, incremental=False,
+                 pack_cycles=False, rng=np.random, tracer=NULL_TRACER):
+        """
+            params
+            ------
+            students : list[Student]
+                Students to trade course spots between.
+            cycle_selection : str
+                How to pick the cycle traded in each SCC:
+                "longest" enumerates cycles (Johnson's algorithm) and randomly
+                picks one of the longest found; "first" trades the first cycle
+                found by walking the SCC.
+            budget : int
+                Max # of edges "longest" may traverse per SCC before settling
+                for the longest cycle found so far (None for no limit).
+            incremental : bool
+                After the first round, only re-process the students who traded
+                (or were left pending) instead of every student; the pruning
+                pass over the graph still runs every round.
+            pack_cycles : bool
+                Trade a maximal set of vertex-disjoint cycles in each SCC per
+                round, instead of a single cycle.
+            rng : np.random.RandomState
+                Random state to break ties between cycles with (defaults to the global one).
+            tracer : tracing.Tracer
+                Receives per-round phase timings and counters.
+        """
+        if cycle_selection not in ("longest", "first"):
+            raise ValueError("Unknown cycle selection: %s" % cycle_selection)
 
         # clear student enrollments
         for student in students:
@@ -17,94 +49,203 @@ class TTC:
             student.enrolled_courses.clear()
 
         self.students = students
+        self.courses = students[0].courses if students else []
         self.top_prefs = {}
         self.tradable_courses = {}
-        self.orig_students = deepcopy(students)
+        self.orig_allocation = Allocation.capture(self.courses, students)
         self.orig_util = sum([s.get_studycard_value() for s in students])
 
+        self.cycle_selection = cycle_selection
+        self.budget = budget
+        self.incremental = incremental
+        self.pack_cycles = pack_cycles
+        self.rng = rng
+        self.tracer = tracer
+
+        # Students entering the round and course -> students holding it
+        self._nodes = set()
+        self._holders = defaultdict(set)
+
+        # Students with room who enrolled in courses while being indexed,
+        # or were finalized while pruning
+        self._pending = set()
+
+        # Order students are visited in when pruning the graph
+        self._position = dict((s, i) for i, s in enumerate(students))
+
+        # How many SCCs were searched for cycles, how many searches the
+        # budget cut short, and how many rounds and cycles were traded
+        self.stats = {"sccs": 0, "budget_exhausted": 0, "rounds": 0, "cycles": 0}
+
     def run(self):
         """
             Do TTC.
         """
+        tracer = self.tracer
+
         # Initialize top preference graph
-        print "Building graph"
-        graph = self._build_graph()
+        with tracer.phase("graph"):
+            graph = self._build_graph()
+
+        # Students leave trading once their studycard fills up in the first
+        # round, so it always needs a full pass
+        rebuild = True
 
         while len(graph) > 1:
+            if tracer.enabled:
+                tracer.count("nodes", len(graph))
+                tracer.count("edges", sum(len(children) for children in graph.itervalues()))
 
             # Find cycles
-            print "Finding cycles"
-            cycles = TTC._find_cycles(graph)
+            cycles = self._find_cycles(graph)
 
             # If there are no cycles, end TTC
             if not cycles:
+                tracer.end_round("ttc", self.stats["rounds"] + 1)
                 break
 
-            # Trade along the cycles
-            print "Trading along cycles"
-            for cycle in cycles:
-                self._trade_on_cycle(cycle)
+            self.stats["rounds"] += 1
+            self.stats["cycles"] += len(cycles)
+
+            touched = [student for cycle in cycles for student in cycle]
+            if not rebuild:
+                # Students who enrolled in courses (or were finalized) last
+                # round need updating too, as the full rebuild would
+                with tracer.phase("graph"):
+                    touched.extend(self._pending.difference(touched))
+                    self._unindex(touched)
 
-            for student in self.students:
-               student.get_studycard_destructive()
+            # Trade along the cycles
+            with tracer.phase("trade"):
+                for cycle in cycles:
+                    self._trade_on_cycle(cycle)
+            if tracer.enabled:
+                tracer.count("cycles", len(cycles))
+                tracer.count("trades", sum(len(cycle) for cycle in cycles))
+
+            if rebuild:
+                with tracer.phase("studycard"):
+                    for student in self.students:
+                       student.get_studycard_destructive()
+
+                    # Build graph again
+                    for student in self.students:
+                        if student.has_room():
+                            student.init_trading()
+
+                with tracer.phase("graph"):
+                    graph = self._build_graph()
+                rebuild = not self.incremental
+            else:
+                with tracer.phase("studycard"):
+                    for student in touched:
+                        student.get_studycard_destructive()
+                        if student.has_room():
+                            student.init_trading()
 
-            # Build graph again
-            for student in self.students:
-                if student.has_room():
-                    student.init_trading()
+                with tracer.phase("graph"):
+                    graph = self._update_graph(touched)
 
-            print "Rebuilding graph"
-            graph = self._build_graph()
+            tracer.end_round("ttc", self.stats["rounds"])
 
         if self.orig_util > sum([s.get_studycard_value() for s in self.students]):
-            self.students = self.orig_students
+            self.orig_allocation.restore(self.courses, self.students)
 
 
     def _build_graph(self):
         """
             Construct a top-preference graph of students.
         """
-        graph = {}
+        self._nodes.clear()
+        self._holders.clear()
+        self._pending.clear()
 
-        nodes = []
         for student in self.students:
-            # Enroll in most preferable courses
-            student._update_preferences()
-            # If student has courses to trade and room in their studycard,
-            # they enter this TTC round
-            if student.has_room() and student.offered_courses:
-                nodes.append(student)
+            self._index(student)
+        return self._prune()
 
-        # Point students at other students who have their top choice course
-        for student in nodes:
-            children = [
-                s for s in nodes
-                if student.top_preference() in s.offered_courses
-                and s != student
-            ]
-            if children:
-                graph[student] = children
+    def _update_graph(self, touched):
+        """
+            Rebuild the graph after the touched students traded, re-indexing
+            only them.
+        """
+        self._pending.difference_update(touched)
+        for student in touched:
+            self._index(student)
+        return self._prune()
+
+    def _prune(self):
+        """
+            Point the indexed students at the students holding their top
+            choice, pruning students as the original list-based builder did:
+            students are visited in order, and one whose top choice nobody
+            still in line holds is dropped. Dropping a student also skips
+            the next student in line, who is finalized with their current
+            study card and leaves trading.
+        """
+        position = self._position
+        candidates = sorted(self._nodes, key=position.get)
+
+        # # of students still in line holding each course
+        n_holders = dict((course, len(holders)) for course, holders in self._holders.iteritems())
+        kept = []
+        skipped = []
+        skip = False
+        for student in candidates:
+            if skip:
+                skipped.append(student)
+                skip = False
+                continue
+            top = student.top_preference()
+            if n_holders.get(top, 0) - (top in student.offered_courses) > 0:
+                kept.append(student)
             else:
-                for k, v in graph.iteritems():
-                    if student in v:
-                        v.remove(student)
-                    graph[k] = v
-                nodes.remove(student)
-
-        # Make sure there are no students pointing at students who were removed above
-        for student in nodes:
-            try:
-                sanitized_children = [
-                    c for c in graph[student]
-                    if c in graph
-                    and student.top_preference() in c.offered_courses
-                ]
-                graph[student] = sanitized_children
-            except KeyError:
-                student.get_studycard_destructive()
+                for course in student.offered_courses:
+                    n_holders[course] -= 1
+                skip = True
 
+        self._unindex(skipped)
+        for student in skipped:
+            student.get_studycard_destructive()
+        # The full rebuild reprocesses them next round
+        self._pending.update(skipped)
+
+        # Point students at other students who have their top choice course
+        graph = {}
+        in_graph = set(kept)
+        for student in kept:
+            holders = self._holders.get(student.top_preference(), ())
+            graph[student] = sorted((s for s in holders if s in in_graph and s is not student),
+                                    key=position.get)
         return graph
 
+    def _index(self, student):
+        """
+            Add a student to the graph indexes if they enter this TTC round.
+        """
+        # Enroll in most preferable courses
+        student._update_preferences()
+        if student.has_room() and student.enrolled_courses:
+            self._pending.add(student)
+
+        # If student has courses to trade and room in their studycard,
+        # they enter this TTC round
+        if student.has_room() and student.offered_courses:
+            self._nodes.add(student)
+            for course in student.offered_courses:
+                self._holders[course].add(student)
+
+    def _unindex(self, students):
+        """
+            Remove students from the graph indexes.
+        """
+        for student in students:
+            if student not in self._nodes:
+                continue
+            self._nodes.remove(student)
+            for course in student.offered_courses:
+                self._holders[course].discard(student)
+
     def _most_preferable_achievable(self, student):
         """
             Get the most preferable course for a student that other students have.
@@ -112,138 +253,162 @@ class TTC:
         self.top_prefs[student] = student.top_preference()
 
     
-    @staticmethod
-    def _find_cycles(graph):
+    def _find_cycles(self, graph):
         """
             Using Tarjan's algorithm for finding Strongly Connected Components,
             find and return all trading cycles of student slots.
-            With reference to: https://en.wikipedia.org/wiki/Tarjan%27s_strongly_connected_components_algorithm
         """
-        # Bookkeeping
-        stack = []
-        index = 0
-        indexes = {}
-        lowlinks = {}
-
-        sccs = []
-        for student in graph.iterkeys():
-            if student not in indexes:
-                scc = TTC._strongconnect(student, index, indexes, lowlinks, stack, graph)
-                sccs.append(scc)
-
-        print "Found ", len(sccs), " SCCs!"
+        with self.tracer.phase("scc"):
+            nodes, indptr, indices = to_csr(graph)
+            sccs = [
+                [nodes[i] for i in scc]
+                for scc in strongly_connected_components(indptr, indices)
+            ]
+        self.tracer.count("sccs", len(sccs))
 
-        # Convert SCCs to cycles
+        # Convert SCCs to cycles, skipping SCCs of length 1
+        # (since those self-loops are automatically resolved)
         cycles = []
-        for scc in sccs:
-            if len(scc) > 1:
-                cycle = TTC._scc_to_cycle_johnson(graph, scc)
-            else:
-                cycle = scc
-            cycles.append(cycle)
-        
-        # Return cycles of length > 1 (since those self-loops are automatically resolved)
-        out_cycles = []
-        for cycle in cycles:
-            if len(cycle) > 1:
-                out_cycles.append(cycle)
-        return out_cycles
-
-    @staticmethod
-    def _strongconnect(node, index, indexes, lowlinks, stack, graph):
+        with self.tracer.phase("cycle_selection"):
+            for scc in sccs:
+                if len(scc) > 1:
+                    if self.pack_cycles:
+                        cycles.extend(self._pack_cycles(graph, scc))
+                    else:
+                        cycles.append(self._scc_to_cycle(graph, scc))
+        return cycles
+
+    def _pack_cycles(self, graph, scc):
         """
-            Tarjan's helper function.
-            With reference to: https://en.wikipedia.org/wiki/Tarjan%27s_strongly_connected_components_algorithm
+            Pick a maximal set of vertex-disjoint cycles within an SCC.
+            After each pick, the rest of the SCC is split into SCCs again
+            and searched until no cycle is left.
         """
-        indexes[node] = index
-        lowlinks[node] = index
-        index += 1
-        stack.append(node)
-
-        if node not in graph:
-            return
-
-        children = graph[node]
-        for child in children:
-            if child not in indexes:
-                TTC._strongconnect(child, index, indexes, lowlinks, stack, graph)
-                lowlinks[node] = min(lowlinks[node], lowlinks[child])
-            elif child in stack:
-                lowlinks[node] = min(lowlinks[node], indexes[child])
-
-        # If we're at an SCC root, build the SCC
-        if lowlinks[node] == indexes[node]:
-            SCC = [node]
-            nxt = stack.pop()
-            while nxt != node:
-                SCC.append(nxt)
-                nxt = stack.pop()
-            return SCC
+        cycles = []
+        remaining = [scc]
+        while remaining:
+            scc = remaining.pop()
+            cycle = self._scc_to_cycle(graph, scc)
+            cycles.append(cycle)
 
-    @staticmethod
-    def _scc_to_cycle_johnson(graph, scc):
+            used = set(cycle)
+            members = set(n for n in scc if n not in used)
+            subgraph = dict((n, [c for c in graph[n] if c in members]) for n in members)
+
+            nodes, indptr, indices = to_csr(subgraph)
+            for sub_scc in strongly_connected_components(indptr, indices):
+                if len(sub_scc) > 1:
+                    remaining.append([nodes[i] for i in sub_scc])
+        return cycles
+
+    def _scc_to_cycle(self, graph, scc):
         """
-            Find all cycles in an SCC using Johnson's algorithm.
+            Pick a cycle to trade on within an SCC, according to self.cycle_selection.
+            Cycles are returned in reverse pointing order.
         """
+        members = set(scc)
+        subgraph = dict((node, [c for c in graph[node] if c in members]) for node in scc)
 
-        def unblock(node, block_set, block_map):
-            if node not in block_set:
-                return
-            block_set.remove(node)
-            for child in block_map[node]:
-                unblock(child, block_set, block_map)
-            del block_map[node]
-
-
-        def findCycles(subgraph, root, curr, block_set=set(), block_map=defaultdict(set), stack=[]):
-            stack.append(curr)
-            block_set.add(curr)
-            found_cycle = False
-                        
-            cycles = []
-            for child in subgraph[curr]:
-                # We found a cycle
-                if child == root:
-                    cycle = stack[::-1]
-                    stack.pop()
-                    cycles.append(cycle)
-                    found_cycle = True 
-                elif child not in block_set:
-                    child_cycles = findCycles(subgraph, root, child, block_set, block_map, stack[:])
-                    cycles.extend(child_cycles)
-                    found_cycle = found_cycle or len(child_cycles)
-
-            if found_cycle:
-                unblock(curr, block_set, block_map)
-            else:
-                for child in subgraph[curr]:
-                    block_map[child].add(curr)
+        self.stats["sccs"] += 1
 
-            stack.pop()
-            return cycles
+        if self.cycle_selection == "first":
+            return TTC._scc_to_cycle_walk(subgraph, scc[0])
 
-        all_cycles = []
-        while scc:
-            subgraph = {}
-            for node in scc:
-                try:
-                    subgraph[node] = [c for c in graph[node] if c in scc]
-                except KeyError:
-                    pass
+        cycles, exhausted = TTC._scc_to_cycles_johnson(subgraph, scc, self.budget)
+        if exhausted:
+            self.stats["budget_exhausted"] += 1
 
-            root = scc.pop()
+        # Randomly choose one of the longest cycles:
+        if cycles:
+            max_len = max([len(c) for c in cycles])
+            max_cycs = [c for c in cycles if len(c) == max_len]
+            return max_cycs[self.rng.randint(len(max_cycs))][::-1]
 
-            new_cycles = findCycles(graph, root, root)
-            all_cycles.extend(new_cycles)
+        # The budget ran out before any cycle closed
+        return TTC._scc_to_cycle_walk(subgraph, scc[0])
 
-        # Randomly choose one of the longest cycles:
-        if all_cycles:
-            max_len = max([len(c) for c in all_cycles])
-            max_cycs = [c for c in all_cycles if len(c) == max_len]
-            return choice(max_cycs)
+    @staticmethod
+    def _scc_to_cycle_walk(subgraph, start):
+        """
+            Follow first children from start until a node repeats.
+            Every node in an SCC has a child in it, so this finds a cycle in O(len(scc)).
+        """
+        path = []
+        seen = {}
+        node = start
+        while node not in seen:
+            seen[node] = len(path)
+            path.append(node)
+            node = subgraph[node][0]
+        return path[seen[node]:][::-1]
 
-        return []
+    @staticmethod
+    def _scc_to_cycles_johnson(subgraph, scc, budget=None):
+        """
+            Find all cycles in an SCC using Johnson's algorithm, traversing at
+            most `budget` edges. Cycles are returned in pointing order.
 
+            Returns (cycles, True if the budget cut enumeration short).
+        """
+
+        def unblock(node, blocked, block_map):
+            stack = [node]
+            while stack:
+                node = stack.pop()
+                if node in blocked:
+                    blocked.remove(node)
+                    stack.extend(block_map.pop(node, ()))
+
+        cycles = []
+        work = 0
+        remaining = set(scc)
+        for root in scc:
+            children = lambda node: [c for c in subgraph[node] if c in remaining]
+
+            path = [root]
+            blocked = set([root])
+            block_map = defaultdict(set)
+            # Frames are [node, unvisited children, whether a cycle was
+            # found through node on the current path]
+            stack = [[root, iter(children(root)), False]]
+            while stack:
+                frame = stack[-1]
+                node, nbrs = frame[0], frame[1]
+                descended = False
+                for child in nbrs:
+                    work += 1
+                    if budget is not None and work > budget:
+                        return cycles, True
+
+                    # We found a cycle
+                    if child == root:
+                        cycles.append(path[:])
+                        frame[2] = True
+                    elif child not in blocked:
+                        path.append(child)
+                        blocked.add(child)
+                        stack.append([child, iter(children(child)), False])
+                        descended = True
+                        break
+
+                if descended:
+                    continue
+
+                found = frame[2]
+                if found:
+                    unblock(node, blocked, block_map)
+                else:
+                    for child in children(node):
+                        block_map[child].add(node)
+                stack.pop()
+                path.pop()
+                if found and stack:
+                    stack[-1][2] = True
+
+            # Cycles through root have all been found
+            remaining.remove(root)
+
+        return cycles, False
 
     def _trade_on_cycle(self, cycle):
         """